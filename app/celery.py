@@ -1,9 +1,15 @@
 import os
+import time
+
+# Set before project modules are imported, they read settings at import time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import task_failure, task_postrun, task_prerun
+from django.conf import settings
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+from app.metrics import TASK_DURATION, TASK_FAILURES, registry
 
 app = Celery('app', broker='redis://redis:6379/0',)
 app.config_from_object('django.conf:settings', namespace='CELERY')
@@ -16,5 +22,40 @@ app.conf.beat_schedule = {
         'task': 'backend.album.tasks.send_message',
         'schedule': crontab(minute=0, hour=3),
     },
+    'delete_expired_movies': {
+        'task': 'backend.album.tasks.delete_expired_movies',
+        'schedule': settings.MOVIE_CLEANUP_INTERVAL,
+    },
 }
 
+if settings.VIEW_COUNTER_BACKEND == 'redis':
+    # Local buffers are kept by web processes, which flush them on requests
+    app.conf.beat_schedule['flush_view_counts'] = {
+        'task': 'backend.album.tasks.flush_view_counts',
+        'schedule': settings.VIEW_COUNTER_FLUSH_INTERVAL,
+    }
+
+# Start times of running tasks by task id
+_task_started_at = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id: str, **kwargs) -> None:
+    _task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id: str, task, state: str = None, **kwargs) -> None:
+    started_at = _task_started_at.pop(task_id, None)
+
+    if started_at is not None:
+        TASK_DURATION.observe(time.perf_counter() - started_at, task=task.name, state=state or '')
+
+    # Workers serve no requests, so their metrics are exposed from dumps
+    registry.dump_if_due()
+
+
+@task_failure.connect
+def count_task_failure(sender, **kwargs) -> None:
+    TASK_FAILURES.inc(task=sender.name)
+
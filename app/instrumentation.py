@@ -0,0 +1,192 @@
+"""
+    Database query instrumentation of requests.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from app.metrics import REQUEST_DURATION, registry
+
+QUERY_INSTRUMENTATION_HEADERS = settings.QUERY_INSTRUMENTATION_HEADERS
+
+UNRESOLVED_ENDPOINT = '<unresolved>'
+
+logger = logging.getLogger(__name__)
+
+_endpoint_stats = defaultdict(lambda: {'requests': 0, 'queries': 0, 'duplicates': 0, 'time': 0.0})
+_endpoint_stats_lock = threading.Lock()
+_current_capture = ContextVar('query_capture', default=None)
+
+
+class QueryCapture:
+    """
+        Context manager, which records SQL, params and time of every query
+        executed in this context on every database.
+
+        The capture is kept in a context variable, which asgiref copies to
+        threads of sync_to_async, so queries of async requests are recorded
+        in whatever thread they run. Enclosing captures record them too.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.parent = None
+        self._token = None
+
+    def __enter__(self):
+        for connection in connections.all():
+            _install_execute_wrapper(connection)
+
+        self.parent = _current_capture.get()
+        self._token = _current_capture.set(self)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_capture.reset(self._token)
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def time(self) -> float:
+        return sum(duration for sql, params, duration in self.queries)
+
+    @property
+    def duplicates(self) -> dict:
+        """
+        Return queries, which were executed more than once with the same params.
+
+        :return: number of executions by SQL
+        :rtype: Dict[str, int]
+        """
+
+        executions = Counter((sql, params) for sql, params, duration in self.queries)
+
+        return {sql: count for (sql, params), count in executions.items() if count > 1}
+
+
+def _record_query(execute, sql, params, many, context):
+    capture = _current_capture.get()
+
+    if capture is None:
+        return execute(sql, params, many, context)
+
+    started_at = time.perf_counter()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        query = (sql, repr(params), time.perf_counter() - started_at)
+
+        while capture is not None:
+            capture.queries.append(query)
+            capture = capture.parent
+
+
+@receiver(connection_created)
+def _install_execute_wrapper(connection, **kwargs) -> None:
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class QueryInstrumentationMiddleware:
+    """
+        Record latency, query count, database time and duplicated
+        queries per endpoint, and add query stats to response headers if
+        QUERY_INSTRUMENTATION_HEADERS is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as coroutine function, like MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        started_at = time.perf_counter()
+
+        with QueryCapture() as capture:
+            response = self.get_response(request)
+
+        return self._record(request, response, capture, started_at)
+
+    async def __acall__(self, request):
+        started_at = time.perf_counter()
+
+        with QueryCapture() as capture:
+            response = await self.get_response(request)
+
+        return self._record(request, response, capture, started_at)
+
+    @staticmethod
+    def _record(request, response, capture: QueryCapture, started_at: float):
+        endpoint = get_endpoint(request)
+        REQUEST_DURATION.observe(time.perf_counter() - started_at, endpoint=endpoint, status=response.status_code)
+        registry.dump_if_due()
+        duplicates = sum(count - 1 for count in capture.duplicates.values())
+
+        with _endpoint_stats_lock:
+            stats = _endpoint_stats[endpoint]
+            stats['requests'] += 1
+            stats['queries'] += capture.count
+            stats['duplicates'] += duplicates
+            stats['time'] += capture.time
+
+        if duplicates:
+            logger.warning('%s executed %i duplicated queries: %r', endpoint, duplicates, list(capture.duplicates))
+
+        if QUERY_INSTRUMENTATION_HEADERS:
+            response['X-DB-Queries'] = capture.count
+            response['X-DB-Time'] = '%.3f' % (capture.time * 1000)
+            response['X-DB-Duplicated-Queries'] = duplicates
+
+        return response
+
+
+def get_endpoint(request) -> str:
+    """
+    Return endpoint name: method and URL name or '<unresolved>'.
+
+    Paths of unresolved requests are not used, so random 404 paths do
+    not add stats and metric labels without limit.
+
+    :param request: HttpRequest
+    :type request: HttpRequest
+    :return: endpoint name
+    :rtype: str
+    """
+
+    resolver_match = request.resolver_match
+
+    return '%s %s' % (request.method, resolver_match.view_name if resolver_match else UNRESOLVED_ENDPOINT)
+
+
+def get_endpoint_stats() -> dict:
+    """
+    Return totals of requests, queries, duplicated queries and database
+    time in seconds by endpoint since the process start.
+
+    :return: stats by endpoint
+    :rtype: dict
+    """
+
+    with _endpoint_stats_lock:
+        return {endpoint: dict(stats) for endpoint, stats in _endpoint_stats.items()}
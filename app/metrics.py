@@ -0,0 +1,345 @@
+"""
+    Metrics in Prometheus text exposition format.
+
+    Metrics are kept in process memory. Processes dump them to
+    METRICS_DIR, if it is set, and exposition merges the dumps of other
+    processes, so metrics of Celery workers are exposed by web processes
+    without a Prometheus server or push gateway.
+"""
+
+import bisect
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+METRICS_DIR = settings.METRICS_DIR
+METRICS_DUMP_INTERVAL = settings.METRICS_DUMP_INTERVAL
+METRICS_ALLOWED_IPS = settings.METRICS_ALLOWED_IPS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """
+        Registry of metrics of the process.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.dump_name = '%s-%i.json' % (socket.gethostname(), os.getpid())
+        self._dumped_at = 0.0
+
+    def register(self, metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError('Metric %s is already registered' % metric.name)
+
+        self.metrics[metric.name] = metric
+
+    def expose(self, directory: str = METRICS_DIR) -> str:
+        """
+        Return metrics of this process and dumps of other processes in text format.
+
+        :param directory: directory of dumps, '' exposes only this process
+        :type directory: str
+        :return: text exposition
+        :rtype: str
+        """
+
+        dumps = self._load_dumps(directory) if directory else []
+        lines = []
+
+        for name, metric in self.metrics.items():
+            values = metric.collect()
+
+            for dump in dumps:
+                for key, value in dump.get(name, ()):
+                    key = tuple(key)
+                    values[key] = metric.merge(values[key], value) if key in values else value
+
+            lines.append('# HELP %s %s' % (name, _escape(metric.documentation, quote=False)))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+
+            for key, value in sorted(values.items()):
+                for suffix, extra_labels, sample in metric.get_samples(value):
+                    labels = list(zip(metric.label_names, key)) + extra_labels
+                    lines.append('%s%s%s %s' % (name, suffix, _format_labels(labels), _format_value(sample)))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, directory: str = METRICS_DIR) -> None:
+        """
+        Save metrics of this process to directory.
+
+        :param directory: directory of dumps
+        :type directory: str
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        data = {
+            name: [[list(key), value] for key, value in metric.collect().items()]
+            for name, metric in self.metrics.items() if metric.is_dumped
+        }
+        file_descriptor, temporary_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+
+        try:
+            with os.fdopen(file_descriptor, 'w') as file:
+                json.dump(data, file)
+
+            os.replace(temporary_path, os.path.join(directory, self.dump_name))
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+        self._dumped_at = time.monotonic()
+
+    def dump_if_due(self, directory: str = METRICS_DIR) -> None:
+        """
+        Save metrics if directory is set and METRICS_DUMP_INTERVAL passed since the last dump.
+
+        :param directory: directory of dumps
+        :type directory: str
+        """
+
+        if directory and time.monotonic() - self._dumped_at >= METRICS_DUMP_INTERVAL:
+            try:
+                self.dump(directory)
+            except OSError:
+                logger.exception('Unable to dump metrics to %s', directory)
+
+    def _load_dumps(self, directory: str) -> list:
+        dumps = []
+
+        for file_name in os.listdir(directory) if os.path.isdir(directory) else ():
+            if file_name == self.dump_name or not file_name.endswith('.json'):
+                continue
+
+            try:
+                with open(os.path.join(directory, file_name)) as file:
+                    dumps.append(json.load(file))
+            except (OSError, ValueError):
+                # Removed or replaced by its process meanwhile
+                continue
+
+        return dumps
+
+
+registry = MetricsRegistry()
+
+
+class Metric:
+    """
+        Base metric with values by label values.
+    """
+
+    type = ''
+    # Values of dumped metrics are merged with values of other processes
+    is_dumped = True
+
+    def __init__(self, name: str, documentation: str, label_names=(), registry: MetricsRegistry = registry):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+        registry.register(self)
+
+    def collect(self) -> dict:
+        """
+        Return copy of values.
+
+        :return: values by label values
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def merge(self, value, other):
+        raise NotImplementedError
+
+    def get_samples(self, value):
+        """
+        Return samples of value.
+
+        :param value: metric value of one label set
+        :type value: Any
+        :return: name suffix, additional labels and sample value
+        :rtype: Iterable[Tuple[str, list, float]]
+        """
+
+        raise NotImplementedError
+
+    def _get_key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError('%s labels must be %s' % (self.name, ', '.join(self.label_names)))
+
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    """
+        Monotonic counter.
+    """
+
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, value, other):
+        return value + other
+
+    def get_samples(self, value):
+        return [('', [], value)]
+
+
+class Histogram(Metric):
+    """
+        Histogram of observed values.
+    """
+
+    type = 'histogram'
+
+    def __init__(
+            self, name: str, documentation: str, label_names=(), buckets=DEFAULT_BUCKETS,
+            registry: MetricsRegistry = registry
+    ):
+        super().__init__(name, documentation, label_names, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, amount: float, **labels) -> None:
+        key = self._get_key(labels)
+        # Last count is of values greater than all buckets
+        index = bisect.bisect_left(self.buckets, amount)
+
+        with self._lock:
+            value = self._values.setdefault(key, {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0})
+            value['counts'][index] += 1
+            value['sum'] += amount
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe duration of the block in seconds.
+        """
+
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def merge(self, value, other):
+        return {
+            'counts': [count + other_count for count, other_count in zip(value['counts'], other['counts'])],
+            'sum': value['sum'] + other['sum'],
+        }
+
+    def get_samples(self, value):
+        samples = []
+        total = 0
+
+        for bound, count in zip(self.buckets + (float('inf'),), value['counts']):
+            total += count
+            samples.append(('_bucket', [('le', _format_value(bound))], total))
+
+        samples.append(('_sum', [], value['sum']))
+        samples.append(('_count', [], total))
+
+        return samples
+
+    @staticmethod
+    def _copy(value):
+        return {'counts': list(value['counts']), 'sum': value['sum']}
+
+
+class CallbackMetric(Metric):
+    """
+        Metric, which values are returned by function at exposition,
+        e.g. stats kept in the shared cache. It is not dumped, processes
+        would expose the same values.
+    """
+
+    is_dumped = False
+
+    def __init__(
+            self, name: str, documentation: str, label_names, function, metric_type: str = 'gauge',
+            registry: MetricsRegistry = registry
+    ):
+        super().__init__(name, documentation, label_names, registry)
+        self.function = function
+        self.type = metric_type
+
+    def collect(self) -> dict:
+        return {tuple(str(label) for label in key): value for key, value in self.function().items()}
+
+    def merge(self, value, other):
+        return value
+
+    def get_samples(self, value):
+        return [('', [], value)]
+
+
+def metrics_view(request):
+    """
+    Expose metrics to scrapers from METRICS_ALLOWED_IPS.
+
+    :param request: HttpRequest
+    :type request: HttpRequest
+    :return: text exposition
+    :rtype: HttpResponse
+    """
+
+    if request.META.get('REMOTE_ADDR') not in METRICS_ALLOWED_IPS:
+        raise Http404
+
+    return HttpResponse(registry.expose(), content_type=CONTENT_TYPE)
+
+
+def _format_labels(labels: list) -> str:
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+def _escape(value: str, quote: bool = True) -> str:
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+
+    return value.replace('"', '\\"') if quote else value
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latency of requests by endpoint and status', ('endpoint', 'status')
+)
+TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Duration of Celery tasks by task and state', ('task', 'state')
+)
+TASK_FAILURES = Counter('celery_task_failures_total', 'Failed Celery tasks', ('task',))
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +56,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Add X-DB-Queries, X-DB-Time (ms) and X-DB-Duplicated-Queries headers to responses
+QUERY_INSTRUMENTATION_HEADERS = bool(DEBUG)
+
+# Directory shared by web and Celery processes, where they dump metrics for /metrics/, '' exposes only the process
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_DUMP_INTERVAL = 10
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+
 ROOT_URLCONF = 'app.urls'
 
 TEMPLATES = [
@@ -87,6 +96,24 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        # Seconds a connection is reused by requests of its thread
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", 60)),
+    }
+}
+
+# Threads, which run async views of one ASGI process, every thread holds its own database connection
+ASYNC_VIEW_THREADS = int(os.environ.get('ASYNC_VIEW_THREADS', 8))
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Process-local caches (the default LocMemCache) disable the response cache and the cache of singleton models,
+# which are invalidated by versions shared by processes. Set CACHE_BACKEND=django_redis.cache.RedisCache and
+# CACHE_LOCATION=redis://redis:6379/1 to enable them.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
 
@@ -132,6 +159,63 @@ ACCEPTED_FILE_MIMETYPES = [
     'image/png',
 ]
 ACCEPTED_FILE_SIZE = 5242880
+ACCEPTED_IMAGE_MAX_PIXELS = 40000000
+# Bytes of upload used to sniff its mime type
+UPLOAD_SNIFF_SIZE = 2048
+# Maximum number of photos in one batch upload (files or archive entries)
+BATCH_UPLOAD_MAX_FILES = 500
+BATCH_UPLOAD_MAX_ARCHIVE_SIZE = 524288000
+# Maximum total size of extracted archive entries, entries are extracted to temporary files
+BATCH_UPLOAD_MAX_UNCOMPRESSED_SIZE = 1073741824
+
+# Photo derivatives by file field name: PIL format (empty keeps source format),
+# (width, height) bounds (None keeps source size) and encoder quality
+PHOTO_RENDITIONS = {
+    'cropped_image': {'format': '', 'size': (800, 600), 'quality': 100},
+    'webp_image': {'format': 'WEBP', 'size': None, 'quality': 100},
+}
+# Unreferenced photo files modified less than this number of seconds ago are deleted later,
+# uploads of identical images may reuse them before their rows are committed
+PHOTO_FILE_DELETE_DELAY = 10 * 60
+# Encoded renditions larger than this are spooled to disk before saving
+IMAGE_SPOOL_MAX_SIZE = 1048576
+
+MOVIE_FRAME_SIZE = (800, 600)
+MOVIE_FRAME_DURATION = 1
+# 'segments' concatenates cached per-photo segments, 'ffmpeg' and 'moviepy' encode all frames,
+# 'webp' and 'gif' make animated image previews with Pillow
+MOVIE_ENCODER = os.environ.get('MOVIE_ENCODER', 'segments')
+# Number of photo segments encoded in parallel by one movie rendering
+MOVIE_RENDER_WORKERS = int(os.environ.get('MOVIE_RENDER_WORKERS', os.cpu_count() or 1))
+MOVIE_CACHE_MAX_BYTES = int(os.environ.get('MOVIE_CACHE_MAX_BYTES', 1073741824))
+# Seconds after creation or start of rendering, when pending and rendering movies are failed by cache lookups
+MOVIE_RENDER_TIMEOUT = int(os.environ.get('MOVIE_RENDER_TIMEOUT', 30 * 60))
+# Seconds after creation or last cache hit, when movie files and links are deleted by delete_expired_movies
+MOVIE_LINK_TTL = int(os.environ.get('MOVIE_LINK_TTL', 7 * 24 * 60 * 60))
+# Downloads and cache hits prolong a link at most once per interval, so downloads do not write on every request
+MOVIE_LINK_TOUCH_INTERVAL = MOVIE_LINK_TTL // 24
+MOVIE_CLEANUP_INTERVAL = int(os.environ.get('MOVIE_CLEANUP_INTERVAL', 60 * 60))
+# Links deleted by one query, one delete_expired_movies run deletes at most MOVIE_CLEANUP_MAX_BATCHES batches
+MOVIE_CLEANUP_BATCH_SIZE = 500
+MOVIE_CLEANUP_MAX_BATCHES = 20
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/2')
+
+# 'local' buffers photo views in process memory and flushes them on requests and at exit,
+# 'redis' shares the buffer between processes and is flushed by the flush_view_counts beat task too
+VIEW_COUNTER_BACKEND = os.environ.get('VIEW_COUNTER_BACKEND', 'local')
+VIEW_COUNTER_FLUSH_INTERVAL = int(os.environ.get('VIEW_COUNTER_FLUSH_INTERVAL', 10))
+# 'database' ranks photos with indexes, 'redis' keeps sorted sets updated on views flush
+LEADERBOARD_BACKEND = os.environ.get('LEADERBOARD_BACKEND', 'database')
+
+# Seconds to keep serialized photos and list pages, they are invalidated by version numbers before that
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+DOWNLOAD_CHUNK_SIZE = 65536
+# Empty to stream downloads from Django, 'X-Accel-Redirect' for nginx or 'X-Sendfile' for apache/lighttpd
+DOWNLOAD_OFFLOAD_HEADER = os.environ.get('DOWNLOAD_OFFLOAD_HEADER', '')
+# nginx internal location which is aliased to MEDIA_ROOT
+DOWNLOAD_OFFLOAD_LOCATION = os.environ.get('DOWNLOAD_OFFLOAD_LOCATION', '/protected/')
 
 EMAIL_USE_TLS = True
 EMAIL_HOST = 'smtp.gmail.com'
@@ -139,6 +223,16 @@ EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 EMAIL_PORT = 587
 
+# Creators of this number of top photos get BestPhotoNotification
+NOTIFICATION_AUDIENCE_SIZE = int(os.environ.get('NOTIFICATION_AUDIENCE_SIZE', 3))
+# Messages sent over one connection at once
+NOTIFICATION_CHUNK_SIZE = 100
+# Messages per second, 0 is unlimited
+NOTIFICATION_RATE_LIMIT = float(os.environ.get('NOTIFICATION_RATE_LIMIT', 0))
+NOTIFICATION_RETRIES = 3
+# Seconds before the first retry of a failed chunk, multiplied by the attempt number
+NOTIFICATION_RETRY_DELAY = 5
+
 CELERY_BROKER_URL = 'redis://redis:6379'
 CELERY_result_backend = 'redis://redis:6379'
 CELERY_accept_content = ['application/json']
@@ -165,6 +259,11 @@ STATIC_URL = '/static/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# Uploaded images and derivatives, which are served with long-lived cache headers
+IMMUTABLE_MEDIA_PREFIX = 'uploads/'
+IMMUTABLE_MEDIA_MAX_AGE = 31536000
+# Pre-encoded one frame movie segments of photos, named by image checksum
+MOVIE_SEGMENTS_ROOT = os.path.join(MEDIA_ROOT, 'segments')
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
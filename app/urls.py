@@ -4,10 +4,14 @@ from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import include
 from django.urls import path, re_path
+from django.views.decorators.cache import cache_control
+from django.views.static import serve
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from app.metrics import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Album API",
@@ -21,11 +25,20 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('backend.api.v1.urls')),
+    path('metrics/', metrics_view, name='metrics'),
 
     re_path(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
 
 if settings.DEBUG:
+    # Uploaded images and derivatives are never overwritten, storage gives new files new names
+    urlpatterns += [
+        re_path(
+            r'^%s(?P<path>%s.*)$' % (settings.MEDIA_URL.lstrip('/'), settings.IMMUTABLE_MEDIA_PREFIX),
+            cache_control(public=True, max_age=settings.IMMUTABLE_MEDIA_MAX_AGE, immutable=True)(serve),
+            {'document_root': settings.MEDIA_ROOT}
+        ),
+    ]
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += staticfiles_urlpatterns()
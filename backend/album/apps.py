@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AlbumConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'backend.album'
+
+    def ready(self):
+        from backend.album import signals  # noqa: F401
@@ -2,25 +2,89 @@
     Contain abstract/base models.
 """
 
-from django.db import models
+import copy
+import time
+
+from django.core.cache import cache
+from django.db import models, transaction
+
+from backend.album.utils import is_cache_shared
 
 
 class SingletonModel(models.Model):
     """
         Singleton pattern to model.
+
+        Loaded object is kept in process memory with the version, which
+        is shared by processes in the cache and incremented on save, so
+        load costs one cache read and no queries until the object changes.
+        Process-local caches cannot invalidate other processes, so with
+        them the object is loaded from the database on every load.
     """
 
+    # Loaded objects by model label: (version, object)
+    _instances = {}
+
     def save(self, *args, **kwargs):
         self.pk = 1
         super().save(*args, **kwargs)
 
+        self._instances.pop(self._meta.label_lower, None)
+        # Other processes reload the object only when it is committed
+        transaction.on_commit(self.invalidate)
+
     def delete(self, *args, **kwargs):
         pass
 
     @classmethod
     def load(cls):
-        obj, _ = cls.objects.get_or_create(pk=1)
-        return obj
+        if not is_cache_shared():
+            return cls.objects.get_or_create(pk=1)[0]
+
+        label = cls._meta.label_lower
+        version = cls._get_version()
+        instance = cls._instances.get(label)
+
+        if instance is None or instance[0] != version:
+            # Version is read before the object, so a concurrent save is seen by the next load
+            obj, _ = cls.objects.get_or_create(pk=1)
+            instance = cls._instances[label] = (version, obj)
+
+        return copy.copy(instance[1])
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """
+        Increment shared version, so every process reloads the object.
+        """
+
+        try:
+            cache.incr(cls._get_version_key())
+        except ValueError:
+            cls._get_version()
+
+    @classmethod
+    def _get_version(cls) -> int:
+        """
+        Return shared version, missing versions start from the current time
+        in nanoseconds, so they never repeat evicted ones.
+
+        :return: version
+        :rtype: int
+        """
+
+        key = cls._get_version_key()
+        version = cache.get(key)
+
+        if version is None:
+            cache.add(key, time.time_ns(), timeout=None)
+            version = cache.get(key)
+
+        return version
+
+    @classmethod
+    def _get_version_key(cls) -> str:
+        return 'singleton:%s:version' % cls._meta.label_lower
 
     class Meta:
         abstract = True
@@ -0,0 +1,340 @@
+"""
+    Contain micro-benchmarks of album hot paths.
+
+    Benchmarks are registered with @benchmark. Every benchmark makes its
+    synthetic data and returns the function, which is timed, optionally
+    with a function, which removes the data. The timed function may
+    return the number of failed operations, which are reported as
+    errors instead of aborting the run. Results are compared by median
+    time.
+"""
+
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from backend.album.encoders import make_movie_encoder
+from backend.album.imaging import make_synthetic_image, render_renditions
+from backend.album.models import Photo, photo_leaderboard
+from backend.album.movies import get_segment_path
+
+PHOTO_RENDITIONS = settings.PHOTO_RENDITIONS
+
+CONCURRENT_REQUESTS = 300
+WSGI_THREADS = 8
+
+User = get_user_model()
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, params=(None,)):
+    """
+    Register benchmark for every param, named 'name[param]'.
+
+    :param name: benchmark name
+    :type name: str
+    :param params: values passed to the benchmark
+    :type params: Iterable
+    :return: decorator
+    :rtype: Callable
+    """
+
+    def decorator(function):
+        for param in params:
+            full_name = name if param is None else '%s[%s]' % (name, param)
+            BENCHMARKS[full_name] = (function, param)
+
+        return function
+    return decorator
+
+
+def run_benchmarks(names=None, repeat: int = 5) -> dict:
+    """
+    Run benchmarks and return their timings in seconds.
+
+    :param names: substrings of benchmark names to run, None runs all
+    :type names: Optional[Iterable[str]]
+    :param repeat: runs of every benchmark
+    :type repeat: int
+    :return: {'min', 'median', 'mean', 'repeat', 'errors'} by benchmark name
+    :rtype: dict
+    """
+
+    results = {}
+
+    for name, (function, param) in BENCHMARKS.items():
+        if names and not any(selected in name for selected in names):
+            continue
+
+        run = function() if param is None else function(param)
+        teardown = None
+        timings = []
+        errors = 0
+
+        if isinstance(run, tuple):
+            run, teardown = run
+
+        try:
+            for _ in range(repeat):
+                started_at = time.perf_counter()
+                errors += run() or 0
+                timings.append(time.perf_counter() - started_at)
+        finally:
+            if teardown is not None:
+                teardown()
+
+        results[name] = {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.mean(timings),
+            'repeat': repeat,
+            'errors': errors,
+        }
+
+    return results
+
+
+def compare_results(baseline: dict, results: dict, threshold: float = 0.1) -> list:
+    """
+    Compare median timings of benchmarks, which exist in both runs.
+
+    :param baseline: results of previous run
+    :type baseline: dict
+    :param results: results of this run
+    :type results: dict
+    :param threshold: relative change, which is not noise
+    :type threshold: float
+    :return: (name, baseline median, median, ratio, 'regression' | 'improvement' | '') sorted by name
+    :rtype: List[Tuple[str, float, float, float, str]]
+    """
+
+    comparison = []
+
+    for name in sorted(set(baseline) & set(results)):
+        before, after = baseline[name]['median'], results[name]['median']
+        ratio = after / before if before else float('inf')
+
+        if ratio > 1 + threshold:
+            verdict = 'regression'
+        elif ratio < 1 - threshold:
+            verdict = 'improvement'
+        else:
+            verdict = ''
+
+        comparison.append((name, before, after, ratio, verdict))
+
+    return comparison
+
+
+@benchmark('render_renditions', params=[
+    source_format + rendition for source_format in ('JPEG', 'PNG') for rendition in ('', *(
+        '-' + name for name in PHOTO_RENDITIONS
+    ))
+])
+def render_renditions_benchmark(param: str):
+    """
+    Render all PHOTO_RENDITIONS of a source format like uploads do,
+    e.g. 'JPEG', or one of them, e.g. 'JPEG-cropped_image'.
+    """
+
+    source_format, _, name = param.partition('-')
+    renditions = {name: PHOTO_RENDITIONS[name]} if name else PHOTO_RENDITIONS
+    source = make_synthetic_image((3000, 2000), source_format)
+
+    def run():
+        source.seek(0)
+        render_renditions(source, renditions)
+
+    return run
+
+
+@benchmark('validate_image', params=('JPEG', 'PNG'))
+def validate_image_benchmark(source_format: str):
+    from backend.api.v1.album.serializers import CreatePhotoSerializer
+
+    content = make_synthetic_image((2000, 1500), source_format).getvalue()
+    serializer = CreatePhotoSerializer()
+
+    def run():
+        serializer.validate_image(SimpleUploadedFile('image.' + source_format.lower(), content))
+
+    return run
+
+
+@benchmark('make_movie', params=(1, 10, 50))
+def make_movie_benchmark(photos_count: int):
+    directory = tempfile.mkdtemp()
+    encoder = make_movie_encoder()
+    image_paths = []
+
+    for seed in range(photos_count):
+        image_path = os.path.join(directory, '%i.jpg' % seed)
+
+        with open(image_path, 'wb') as image:
+            image.write(make_synthetic_image((1600, 1200), 'JPEG', seed).getvalue())
+
+        image_paths.append(image_path)
+
+    def run():
+        # New checksums on every run, so segments are never cached
+        photos = [
+            SimpleNamespace(image=SimpleNamespace(path=image_path), ensure_checksum=_make_checksum())
+            for image_path in image_paths
+        ]
+
+        try:
+            encoder.encode(photos, os.path.join(directory, 'movie' + encoder.extension))
+        finally:
+            for photo in photos:
+                if os.path.exists(get_segment_path(photo.ensure_checksum())):
+                    os.remove(get_segment_path(photo.ensure_checksum()))
+
+    return run, lambda: shutil.rmtree(directory, ignore_errors=True)
+
+
+@benchmark('get_top_photos', params=(10000, 1000000))
+def get_top_photos_benchmark(rows: int):
+    seed_photos(rows)
+
+    def run():
+        list(Photo.get_top_photos())
+
+    return run
+
+
+@benchmark('serialize_list')
+def serialize_list_benchmark():
+    from backend.api.v1.album.serializers import ListPhotoSerializer
+
+    seed_photos(100)
+
+    def run():
+        ListPhotoSerializer(Photo.objects.all()[:100], many=True).data
+
+    return run
+
+
+@benchmark('serialize_retrieve')
+def serialize_retrieve_benchmark():
+    from backend.api.v1.album.serializers import UpdatePhotoSerializer
+
+    seed_photos(1)
+    pk = Photo.objects.values_list('pk', flat=True).first()
+
+    def run():
+        UpdatePhotoSerializer(Photo.objects.get(pk=pk)).data
+
+    return run
+
+
+@benchmark('serve_concurrently', params=('wsgi', 'asgi'))
+def serve_concurrently_benchmark(server: str):
+    """
+    Serve CONCURRENT_REQUESTS photo page, photo and movie download
+    requests at once, by WSGI_THREADS threads like a threaded WSGI
+    server or by async views in one event loop like an ASGI server.
+    """
+
+    from django.test import AsyncClient, Client
+    from django.urls import reverse
+    from rest_framework.authtoken.models import Token
+
+    from backend.album.models import PhotoDownloadLink
+
+    seed_photos(100)
+    photo_id = Photo.objects.values_list('pk', flat=True).first()
+    token, _ = Token.objects.get_or_create(user=User.objects.first())
+    link = PhotoDownloadLink.make_link()
+    link.mark_ready()
+
+    with open(link.file_path, 'wb') as file:
+        file.write(os.urandom(1048576))
+
+    prefix = 'async-' if server == 'asgi' else ''
+    urls = [
+        reverse(prefix + url_name, args=args) for url_name, args in (
+            ('album-list', ()), ('album-detail', (photo_id,)), ('photo_download_link-detail', (link.pk,))
+        )
+    ] * (CONCURRENT_REQUESTS // 3)
+
+    def get(url):
+        response = Client(HTTP_AUTHORIZATION='Token ' + token.key, raise_request_exception=False).get(url)
+
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+        return response.status_code
+
+    async def get_all():
+        client = AsyncClient(raise_request_exception=False)
+        responses = await asyncio.gather(*(client.get(url, authorization='Token ' + token.key) for url in urls))
+
+        return [response.status_code for response in responses]
+
+    def run():
+        if server == 'asgi':
+            # Not async_to_sync, which would run the views in this thread
+            status_codes = asyncio.run(get_all())
+        else:
+            with ThreadPoolExecutor(max_workers=WSGI_THREADS) as executor:
+                status_codes = list(executor.map(get, urls))
+
+        # Errors, e.g. locked SQLite tables, are counted, so they do not abort other benchmarks
+        return sum(1 for status_code in status_codes if not 200 <= status_code < 300)
+
+    def teardown():
+        os.remove(link.file_path)
+        link.delete()
+
+    return run, teardown
+
+
+def seed_photos(rows: int, batch_size: int = 10000) -> None:
+    """
+    Add photo rows without files up to rows, ranked by random views.
+
+    :param rows: number of photos in the table
+    :type rows: int
+    :param batch_size: rows per INSERT
+    :type batch_size: int
+    """
+
+    missing = rows - Photo.objects.count()
+
+    if missing <= 0:
+        return
+
+    creators = list(User.objects.all()[:100])
+
+    if not creators:
+        creators = [User.objects.create(username='benchmark', email='benchmark@example.com')]
+
+    while missing > 0:
+        Photo.objects.bulk_create([
+            Photo(
+                title='benchmark', image='uploads/benchmark.jpg', checksum=_make_checksum()(),
+                creator=random.choice(creators), views=int(random.paretovariate(1.2))
+            )
+            for _ in range(min(batch_size, missing))
+        ])
+        missing -= batch_size
+
+    photo_leaderboard.rebuild()
+
+
+def _make_checksum():
+    checksum = uuid.uuid4().hex * 2
+
+    return lambda: checksum
@@ -0,0 +1,284 @@
+"""
+    Contain write-behind counters, which accumulate increments of model
+    fields and flush them to the database in bulk.
+"""
+
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import redis
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+
+REDIS_URL = settings.REDIS_URL
+VIEW_COUNTER_BACKEND = settings.VIEW_COUNTER_BACKEND
+VIEW_COUNTER_FLUSH_INTERVAL = settings.VIEW_COUNTER_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Sent with field_name, counts and lag arguments after increments are saved,
+# lag is seconds since the oldest increment or None if it is unknown
+counter_flushed = Signal()
+
+
+class BufferedCounter:
+    """
+        Base buffered counter of integer model field.
+    """
+
+    def __init__(self, model, field_name: str, auto_now_field: str = ''):
+        self.model = model
+        self.field_name = field_name
+        self.auto_now_field = auto_now_field
+        self.key = 'album:counter:%s:%s' % (model._meta.label_lower, field_name)
+
+    def add(self, pk: int, count: int = 1) -> None:
+        """
+        Buffer increment of object's field.
+
+        :param pk: object primary key
+        :type pk: int
+        :param count: increment
+        :type count: int
+        """
+
+        raise NotImplementedError
+
+    def flush(self) -> int:
+        """
+        Write buffered increments to the database.
+
+        Increments are returned to the buffer if the database update fails
+        and are sent with counter_flushed signal otherwise.
+
+        :return: number of flushed increments
+        :rtype: int
+        """
+
+        counts, started_at = self._take()
+
+        if not counts:
+            return 0
+
+        try:
+            self._apply(counts)
+        except Exception:
+            self._restore(counts)
+            raise
+
+        self._commit()
+        counter_flushed.send(
+            sender=self.model, field_name=self.field_name, counts=counts,
+            lag=time.time() - started_at if started_at is not None else None
+        )
+
+        return sum(counts.values())
+
+    def _apply(self, counts: dict) -> None:
+        """
+        Update objects with one F() expression UPDATE per distinct increment.
+
+        :param counts: increments by primary key
+        :type counts: dict
+        """
+
+        pks_by_count = defaultdict(list)
+        fields = {}
+
+        for pk, count in counts.items():
+            pks_by_count[count].append(pk)
+
+        if self.auto_now_field:
+            fields[self.auto_now_field] = timezone.now()
+
+        with transaction.atomic():
+            for count, pks in pks_by_count.items():
+                self.model.objects.filter(pk__in=pks).update(
+                    **{self.field_name: F(self.field_name) + count}, **fields
+                )
+
+    def _take(self) -> tuple:
+        """
+        Take buffered increments.
+
+        :return: increments by primary key and time of the oldest increment or None, if it is unknown
+        :rtype: Tuple[dict, Optional[float]]
+        """
+
+        raise NotImplementedError
+
+    def _restore(self, counts: dict) -> None:
+        raise NotImplementedError
+
+    def _commit(self) -> None:
+        raise NotImplementedError
+
+
+class LocalBufferedCounter(BufferedCounter):
+    """
+        Counter buffered in process memory.
+
+        The buffer is flushed lazily by the request, which finds it older
+        than VIEW_COUNTER_FLUSH_INTERVAL, and at process exit, so an idle
+        process keeps its increments until the next request. The
+        flush_view_counts task runs in Celery workers and cannot flush
+        buffers of web processes, so it is scheduled only for Redis.
+    """
+
+    def __init__(self, model, field_name: str, auto_now_field: str = ''):
+        super().__init__(model, field_name, auto_now_field)
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._started_at = None
+
+        atexit.register(self._flush_quietly)
+
+    def add(self, pk: int, count: int = 1) -> None:
+        with self._lock:
+            if not self._counts:
+                self._started_at = time.time()
+
+            self._counts[pk] += count
+            is_due = time.monotonic() - self._flushed_at >= VIEW_COUNTER_FLUSH_INTERVAL
+
+        if is_due:
+            self._flush_quietly()
+
+    def _take(self) -> tuple:
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            started_at, self._started_at = self._started_at, None
+            self._flushed_at = time.monotonic()
+
+        return counts, started_at
+
+    def _restore(self, counts: dict) -> None:
+        with self._lock:
+            if not self._counts:
+                self._started_at = time.time()
+
+            for pk, count in counts.items():
+                self._counts[pk] += count
+
+    def _commit(self) -> None:
+        pass
+
+    def _flush_quietly(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Unable to flush %s', self.key)
+
+
+class RedisBufferedCounter(BufferedCounter):
+    """
+        Counter buffered in Redis hash, shared by all processes.
+
+        Flush renames the hash and deletes it only after the database
+        update, so increments survive crashes of both web and Celery
+        workers. The renamed hash is tagged with a batch id, which is
+        saved with the UPDATE, so a hash, which was not deleted after a
+        successful update, is not applied again.
+    """
+
+    lock_timeout = 60
+
+    def __init__(self, model, field_name: str, auto_now_field: str = ''):
+        super().__init__(model, field_name, auto_now_field)
+        self.flushing_key = self.key + ':flushing'
+        self.started_at_key = self.key + ':started_at'
+        self.batch_key = self.key + ':batch'
+        self.batch = None
+        self.client = redis.Redis.from_url(REDIS_URL)
+
+    def add(self, pk: int, count: int = 1) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hincrby(self.key, pk, count)
+        pipeline.set(self.started_at_key, time.time(), nx=True)
+        pipeline.execute()
+
+    def flush(self) -> int:
+        lock = self.client.lock(self.key + ':lock', timeout=self.lock_timeout)
+
+        if not lock.acquire(blocking=False):
+            return 0
+
+        try:
+            return super().flush()
+        finally:
+            lock.release()
+
+    def _take(self) -> tuple:
+        started_at = None
+
+        if not self.client.exists(self.flushing_key):
+            pipeline = self.client.pipeline()
+            pipeline.get(self.started_at_key)
+            pipeline.delete(self.started_at_key)
+            pipeline.rename(self.key, self.flushing_key)
+
+            try:
+                started_at = pipeline.execute()[0]
+            except redis.ResponseError:
+                return {}, None
+
+        # Batch id is kept until the hash is deleted, so retries of the hash get the same id
+        self.client.set(self.batch_key, uuid.uuid4().hex, nx=True)
+        self.batch = (self.client.get(self.batch_key) or b'').decode()
+        counts = {
+            int(pk): int(count) for pk, count in self.client.hgetall(self.flushing_key).items()
+        }
+
+        return counts, float(started_at) if started_at else None
+
+    def _apply(self, counts: dict) -> None:
+        counter_batch_model = apps.get_model('album', 'CounterBatch')
+
+        with transaction.atomic():
+            if counter_batch_model.objects.filter(batch=self.batch).exists():
+                logger.warning('Batch %s of %s is already saved', self.batch, self.key)
+                return
+
+            super()._apply(counts)
+            counter_batch_model.objects.create(key=self.key, batch=self.batch)
+
+    def _restore(self, counts: dict) -> None:
+        # Counts stay in flushing_key and are taken by the next flush
+        pass
+
+    def _commit(self) -> None:
+        self.client.delete(self.flushing_key, self.batch_key)
+        # Flushes hold the lock, so no other batch of the counter is in progress
+        apps.get_model('album', 'CounterBatch').objects.filter(key=self.key).delete()
+
+
+BUFFERED_COUNTERS = {
+    'local': LocalBufferedCounter,
+    'redis': RedisBufferedCounter,
+}
+
+
+def make_buffered_counter(model, field_name: str, auto_now_field: str = '') -> BufferedCounter:
+    """
+    Make counter of VIEW_COUNTER_BACKEND type.
+
+    :param model: Model class
+    :type model: Type[Model]
+    :param field_name: integer field name
+    :type field_name: str
+    :param auto_now_field: datetime field, which is set to now by flush
+    :type auto_now_field: str
+    :return: counter
+    :rtype: BufferedCounter
+    """
+
+    return BUFFERED_COUNTERS[VIEW_COUNTER_BACKEND](model, field_name, auto_now_field)
@@ -0,0 +1,204 @@
+"""
+    Contain movie encoders, which make a slideshow of photos with one
+    MOVIE_FRAME_DURATION frame per photo.
+"""
+
+import logging
+import time
+from typing import NamedTuple
+
+from PIL import Image
+from django.conf import settings
+
+from backend.album.imaging import render_frame
+from backend.album.metrics import MOVIE_FRAMES, MOVIE_RENDER_DURATION
+from backend.album.movies import MovieRenderError, encode_frames, make_movie
+
+MOVIE_ENCODER = settings.MOVIE_ENCODER
+MOVIE_FRAME_SIZE = settings.MOVIE_FRAME_SIZE
+MOVIE_FRAME_DURATION = settings.MOVIE_FRAME_DURATION
+
+logger = logging.getLogger(__name__)
+
+
+class EncodingStats(NamedTuple):
+    frames: int
+    seconds: float
+
+    @property
+    def frames_per_second(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+
+class MovieEncoder:
+    """
+        Base movie encoder.
+
+        Frames are letterboxed to MOVIE_FRAME_SIZE by every encoder.
+    """
+
+    name = ''
+    extension = '.webm'
+    content_type = 'audio/webm'
+
+    def encode(self, images, movie_path: str) -> EncodingStats:
+        """
+        Encode photos to movie file and log throughput.
+
+        :param images: Photo's QuerySet or list of photos in frame order
+        :type images: Iterable[Photo]
+        :param movie_path: output file path
+        :type movie_path: str
+        :return: number of frames and encoding time
+        :rtype: EncodingStats
+        :raises MovieRenderError: if there are no frames or encoding fails
+        """
+
+        images = list(images)
+
+        if not images:
+            raise MovieRenderError('No frames to render')
+
+        started_at = time.perf_counter()
+        frames = self._encode(images, movie_path)
+        stats = EncodingStats(frames, time.perf_counter() - started_at)
+
+        logger.info(
+            '%s encoder: %i frames in %.3f s (%.1f fps)',
+            self.name, stats.frames, stats.seconds, stats.frames_per_second
+        )
+        MOVIE_RENDER_DURATION.observe(stats.seconds, encoder=self.name)
+        MOVIE_FRAMES.observe(stats.frames, encoder=self.name)
+
+        return stats
+
+    def _encode(self, images: list, movie_path: str) -> int:
+        raise NotImplementedError
+
+    @staticmethod
+    def _iter_frames(images: list):
+        for photo in images:
+            yield render_frame(photo.image.path, MOVIE_FRAME_SIZE)
+
+
+class SegmentsEncoder(MovieEncoder):
+    """
+        Concatenates cached per-photo segments without re-encoding.
+    """
+
+    name = 'segments'
+
+    def _encode(self, images: list, movie_path: str) -> int:
+        return make_movie(images, movie_path)
+
+
+class FfmpegEncoder(MovieEncoder):
+    """
+        Pipes raw frames to ffmpeg process.
+    """
+
+    name = 'ffmpeg'
+
+    def _encode(self, images: list, movie_path: str) -> int:
+        return encode_frames(self._iter_frames(images), movie_path)
+
+
+class MoviepyEncoder(MovieEncoder):
+    """
+        Encodes frames with moviepy, which keeps all of them in memory.
+    """
+
+    name = 'moviepy'
+
+    def _encode(self, images: list, movie_path: str) -> int:
+        # moviepy.editor imports numpy, imageio and the ffmpeg wrapper, so only this encoder pays for it
+        import numpy
+        from moviepy.editor import ImageSequenceClip
+
+        width, height = MOVIE_FRAME_SIZE
+        frames = [
+            numpy.frombuffer(frame, dtype=numpy.uint8).reshape(height, width, 3)
+            for frame in self._iter_frames(images)
+        ]
+
+        try:
+            ImageSequenceClip(
+                frames, durations=[MOVIE_FRAME_DURATION] * len(frames)
+            ).write_videofile(
+                movie_path, fps=1 / MOVIE_FRAME_DURATION, codec='libvpx', audio=False, logger=None
+            )
+        except (IOError, OSError) as error:
+            raise MovieRenderError(str(error)) from error
+
+        return len(frames)
+
+
+class PillowEncoder(MovieEncoder):
+    """
+        Saves frames to animated image, which is a cheap preview
+        without ffmpeg.
+    """
+
+    file_format = ''
+
+    def _encode(self, images: list, movie_path: str) -> int:
+        frames = [Image.frombytes('RGB', MOVIE_FRAME_SIZE, frame) for frame in self._iter_frames(images)]
+
+        frames[0].save(
+            movie_path, format=self.file_format, save_all=True, append_images=frames[1:],
+            duration=int(MOVIE_FRAME_DURATION * 1000), loop=0
+        )
+
+        return len(frames)
+
+
+class WebpEncoder(PillowEncoder):
+    name = 'webp'
+    extension = '.webp'
+    content_type = 'image/webp'
+    file_format = 'WEBP'
+
+
+class GifEncoder(PillowEncoder):
+    name = 'gif'
+    extension = '.gif'
+    content_type = 'image/gif'
+    file_format = 'GIF'
+
+
+MOVIE_ENCODERS = {
+    encoder.name: encoder
+    for encoder in (SegmentsEncoder, FfmpegEncoder, MoviepyEncoder, WebpEncoder, GifEncoder)
+}
+
+
+def make_movie_encoder(name: str = MOVIE_ENCODER) -> MovieEncoder:
+    """
+    Make movie encoder of MOVIE_ENCODER type.
+
+    :param name: encoder name
+    :type name: str
+    :return: encoder
+    :rtype: MovieEncoder
+    """
+
+    return MOVIE_ENCODERS[name]()
+
+
+def get_content_type(file_name: str) -> str:
+    """
+    Return content type of movie file made by any encoder.
+
+    :param file_name: movie file name
+    :type file_name: str
+    :return: content type
+    :rtype: str
+    """
+
+    for encoder in MOVIE_ENCODERS.values():
+        if file_name.endswith(encoder.extension):
+            return encoder.content_type
+    return 'application/octet-stream'
+
+
+movie_encoder = make_movie_encoder()
@@ -0,0 +1,199 @@
+"""
+    Contain image processing engine, which decodes source image once
+    and makes all renditions from it.
+"""
+
+import time
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files import File
+
+from backend.album.utils import make_valid_format
+
+IMAGE_SPOOL_MAX_SIZE = settings.IMAGE_SPOOL_MAX_SIZE
+
+EXIF_ORIENTATION = 0x0112
+
+
+def render_renditions(source, renditions: dict):
+    """
+    Decode source image once and encode it to every rendition.
+
+    JPEG sources are decoded at reduced scale with draft() only when the
+    largest rendition is smaller than the source. A rendition without
+    size keeps the source size, so it needs a full scale decode, e.g.
+    webp_image of the default PHOTO_RENDITIONS.
+
+    :param source: image file
+    :type source: File
+    :param renditions: rendition options (format, size, quality) by name
+    :type renditions: dict
+    :return: encoded files with their formats by name and timings by name in seconds
+    :rtype: Tuple[Dict[str, Tuple[File, str]], Dict[str, float]]
+    """
+
+    started_at = time.perf_counter()
+    image = Image.open(source)
+    source_format = image.format
+    # Image may be rotated by EXIF orientation, so sides are compared with the largest rendition side
+    largest_side = max(max(rendition['size'] or image.size) for rendition in renditions.values())
+
+    if source_format == 'JPEG' and largest_side < min(image.size):
+        image.draft('RGB', (largest_side, largest_side))
+
+    image = _apply_exif_orientation(image)
+    timings = {'decode': time.perf_counter() - started_at}
+    files = {}
+
+    for name, rendition in renditions.items():
+        started_at = time.perf_counter()
+        file_format = make_valid_format(rendition['format'] or source_format)
+
+        files[name] = (
+            _encode(_fit(image, rendition['size']), file_format, rendition['quality']),
+            file_format
+        )
+        timings[name] = time.perf_counter() - started_at
+
+    return files, timings
+
+
+def render_frame(source, size) -> bytes:
+    """
+    Decode image and letterbox it to size as raw RGB movie frame.
+
+    The image is scaled to fit size, keeping aspect ratio, and centered
+    on black background.
+
+    :param source: image file or path
+    :type source: Union[File, str]
+    :param size: (width, height) of frame
+    :type size: Tuple[int, int]
+    :return: width * height * 3 bytes
+    :rtype: bytes
+    """
+
+    image = Image.open(source)
+
+    if image.format == 'JPEG':
+        image.draft('RGB', (max(size), max(size)))
+
+    image = _apply_exif_orientation(image)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    ratio = min(size[0] / image.width, size[1] / image.height)
+    fitted_size = (max(round(image.width * ratio), 1), max(round(image.height * ratio), 1))
+
+    if fitted_size != image.size:
+        image = image.resize(fitted_size, Image.LANCZOS, reducing_gap=3.0)
+
+    if image.size == tuple(size):
+        return image.tobytes()
+
+    frame = Image.new('RGB', tuple(size))
+    frame.paste(image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2))
+
+    return frame.tobytes()
+
+
+def make_synthetic_image(size, file_format: str = 'JPEG', seed: int = 0) -> BytesIO:
+    """
+    Make photo-like image: colored gradients with noise, which compresses
+    like a real photo and differs for every seed.
+
+    :param size: (width, height)
+    :type size: Tuple[int, int]
+    :param file_format: PIL format
+    :type file_format: str
+    :param seed: variation of colors and noise
+    :type seed: int
+    :return: encoded image at start position
+    :rtype: BytesIO
+    """
+
+    channels = []
+
+    for channel in range(3):
+        gradient = Image.linear_gradient('L').rotate((seed * 37 + channel * 120) % 360)
+        noise = Image.effect_noise((256, 256), 16 + (seed + channel) % 48)
+        channels.append(Image.blend(gradient, noise, 0.25).resize(size, Image.BILINEAR))
+
+    output = BytesIO()
+    Image.merge('RGB', channels).save(output, format=file_format)
+    output.seek(0)
+
+    return output
+
+
+def _apply_exif_orientation(image: Image.Image) -> Image.Image:
+    """
+    Decode image and rotate it by EXIF orientation, if it is needed.
+
+    :param image: opened image
+    :type image: Image
+    :return: decoded image
+    :rtype: Image
+    """
+
+    if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+        return ImageOps.exif_transpose(image)
+
+    image.load()
+    return image
+
+
+def _fit(image: Image.Image, size) -> Image.Image:
+    """
+    Downscale image to fit size, keeping aspect ratio.
+
+    :param image: decoded image
+    :type image: Image
+    :param size: (width, height) bounds or None to keep image size
+    :type size: Optional[Tuple[int, int]]
+    :return: image, which fits size
+    :rtype: Image
+    """
+
+    if not size:
+        return image
+
+    ratio = min(size[0] / image.width, size[1] / image.height)
+
+    if ratio >= 1:
+        return image
+
+    # reducing_gap lets Pillow reduce() the image by an integer factor before resampling
+    return image.resize(
+        (max(round(image.width * ratio), 1), max(round(image.height * ratio), 1)),
+        Image.LANCZOS,
+        reducing_gap=3.0
+    )
+
+
+def _encode(image: Image.Image, file_format: str, quality: int) -> File:
+    """
+    Encode image to temporary file, which is spooled to disk when it grows.
+
+    :param image: decoded image
+    :type image: Image
+    :param file_format: PIL format
+    :type file_format: str
+    :param quality: encoder quality
+    :type quality: int
+    :return: encoded file at start position
+    :rtype: File
+    """
+
+    if file_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    output = SpooledTemporaryFile(max_size=IMAGE_SPOOL_MAX_SIZE)
+    image.save(output, format=file_format, quality=quality)
+    output.seek(0)
+
+    return File(output)
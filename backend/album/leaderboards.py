@@ -0,0 +1,194 @@
+"""
+    Contain leaderboards of objects ordered by integer model field.
+"""
+
+import redis
+from django.conf import settings
+from django.db.models import Case, QuerySet, Value, When
+from django.db.models.signals import post_delete, post_save
+
+from backend.album.counters import counter_flushed
+
+LEADERBOARD_BACKEND = settings.LEADERBOARD_BACKEND
+REDIS_URL = settings.REDIS_URL
+
+
+class Leaderboard:
+    """
+        Base leaderboard, which is a top of objects by score_field
+        globally and per group_field value.
+    """
+
+    def __init__(self, model, score_field: str, group_field: str):
+        self.model = model
+        self.score_field = score_field
+        self.group_field = group_field
+        self.key = 'album:leaderboard:%s:%s' % (model._meta.label_lower, score_field)
+
+    def top(self, limit: int, group_id: int = None) -> QuerySet:
+        """
+        Return QuerySet of top objects.
+
+        :param limit: objects count
+        :type limit: int
+        :param group_id: group_field value or None for global top
+        :type group_id: int
+        :return: QuerySet ordered by score
+        :rtype: QuerySet
+        """
+
+        raise NotImplementedError
+
+    def rebuild(self) -> int:
+        """
+        Reconcile leaderboard with score_field values in the database.
+
+        :return: number of ranked objects
+        :rtype: int
+        """
+
+        raise NotImplementedError
+
+
+class DatabaseLeaderboard(Leaderboard):
+    """
+        Leaderboard served by indexes on (score_field) and
+        (group_field, score_field), so there is nothing to maintain.
+    """
+
+    def top(self, limit: int, group_id: int = None) -> QuerySet:
+        queryset = self.model.objects.all()
+
+        if group_id is not None:
+            queryset = queryset.filter(**{self.group_field: group_id})
+
+        return queryset.order_by('-%s' % self.score_field)[:limit]
+
+    def rebuild(self) -> int:
+        return self.model.objects.count()
+
+
+class RedisLeaderboard(Leaderboard):
+    """
+        Leaderboard kept in Redis sorted sets.
+
+        Scores are incremented when a BufferedCounter of score_field
+        is flushed, and objects are added and removed with model signals.
+    """
+
+    chunk_size = 10000
+
+    def __init__(self, model, score_field: str, group_field: str):
+        super().__init__(model, score_field, group_field)
+        self.client = redis.Redis.from_url(REDIS_URL)
+        self.group_attname = model._meta.get_field(group_field).attname
+
+        post_save.connect(self._on_save, sender=model, weak=False)
+        post_delete.connect(self._on_delete, sender=model, weak=False)
+        counter_flushed.connect(self._on_counter_flushed, sender=model, weak=False)
+
+    def top(self, limit: int, group_id: int = None) -> QuerySet:
+        pks = [int(pk) for pk in self.client.zrevrange(self._get_key(group_id), 0, limit - 1)]
+
+        if not pks:
+            return self.model.objects.none()
+
+        return self.model.objects.filter(pk__in=pks).order_by(
+            Case(*[When(pk=pk, then=Value(position)) for position, pk in enumerate(pks)])
+        )
+
+    def rebuild(self) -> int:
+        suffix = ':rebuild'
+        keys = set()
+        ranked = 0
+        rows = self.model.objects.values_list(
+            'pk', self.group_attname, self.score_field
+        ).iterator(chunk_size=self.chunk_size)
+
+        self.client.delete(self.key + suffix)
+        pipeline = self.client.pipeline(transaction=False)
+
+        for pk, group_id, score in rows:
+            group_key = self._get_key(group_id)
+
+            if group_key not in keys:
+                keys.add(group_key)
+                pipeline.delete(group_key + suffix)
+
+            pipeline.zadd(self.key + suffix, {pk: score})
+            pipeline.zadd(group_key + suffix, {pk: score})
+            ranked += 1
+
+            if ranked % self.chunk_size == 0:
+                pipeline.execute()
+
+        pipeline.execute()
+
+        for key in self.client.scan_iter(match=self._get_key('*')):
+            key = key.decode()
+
+            if key not in keys and not key.endswith(suffix):
+                self.client.delete(key)
+
+        for key in keys | {self.key}:
+            if self.client.exists(key + suffix):
+                self.client.rename(key + suffix, key)
+            else:
+                self.client.delete(key)
+
+        return ranked
+
+    def _get_key(self, group_id=None) -> str:
+        if group_id is None:
+            return self.key
+        return '%s:%s:%s' % (self.key, self.group_field, group_id)
+
+    def _on_save(self, instance, created: bool, **kwargs) -> None:
+        if created:
+            score = getattr(instance, self.score_field)
+            pipeline = self.client.pipeline()
+            pipeline.zadd(self.key, {instance.pk: score})
+            pipeline.zadd(self._get_key(getattr(instance, self.group_attname)), {instance.pk: score})
+            pipeline.execute()
+
+    def _on_delete(self, instance, **kwargs) -> None:
+        pipeline = self.client.pipeline()
+        pipeline.zrem(self.key, instance.pk)
+        pipeline.zrem(self._get_key(getattr(instance, self.group_attname)), instance.pk)
+        pipeline.execute()
+
+    def _on_counter_flushed(self, field_name: str, counts: dict, **kwargs) -> None:
+        if field_name != self.score_field:
+            return
+
+        groups = self.model.objects.filter(pk__in=counts).values_list('pk', self.group_attname)
+        pipeline = self.client.pipeline()
+
+        for pk, group_id in groups:
+            pipeline.zincrby(self.key, counts[pk], pk)
+            pipeline.zincrby(self._get_key(group_id), counts[pk], pk)
+
+        pipeline.execute()
+
+
+LEADERBOARDS = {
+    'database': DatabaseLeaderboard,
+    'redis': RedisLeaderboard,
+}
+
+
+def make_leaderboard(model, score_field: str, group_field: str) -> Leaderboard:
+    """
+    Make leaderboard of LEADERBOARD_BACKEND type.
+
+    :param model: Model class
+    :type model: Type[Model]
+    :param score_field: integer field name
+    :type score_field: str
+    :param group_field: field name of per group tops
+    :type group_field: str
+    :return: leaderboard
+    :rtype: Leaderboard
+    """
+
+    return LEADERBOARDS[LEADERBOARD_BACKEND](model, score_field, group_field)
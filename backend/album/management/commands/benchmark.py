@@ -0,0 +1,95 @@
+import json
+import platform
+import subprocess
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from backend.album.benchmarks import BENCHMARKS, compare_results, run_benchmarks
+from backend.album.models import photo_views_counter
+
+
+class Command(BaseCommand):
+    help = 'Run album micro-benchmarks in a temporary test database and compare them with a previous run'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help='Substrings of benchmark names to run, all benchmarks run by default'
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of every benchmark')
+        parser.add_argument('--output', help='Save results to JSON file')
+        parser.add_argument('--compare', help='JSON file of a previous run, regressions fail the command')
+        parser.add_argument(
+            '--threshold', type=float, default=0.1,
+            help='Relative change of median time, which is reported as regression or improvement'
+        )
+        parser.add_argument('--list', action='store_true', help='List benchmarks and exit')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['list']:
+            self.stdout.write('\n'.join(BENCHMARKS))
+            return
+
+        # Benchmarks add up to a million rows, so they never touch the configured database
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            results = run_benchmarks(kwargs['names'], kwargs['repeat'])
+        finally:
+            # Views buffered by served requests would be flushed at exit, after the database is destroyed
+            photo_views_counter.flush()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for name, result in results.items():
+            line = '%-32s median %10.6f s  min %10.6f s' % (name, result['median'], result['min'])
+
+            if result['errors']:
+                line = self.style.WARNING('%s  %i errors' % (line, result['errors']))
+
+            self.stdout.write(line)
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as output:
+                json.dump({
+                    'commit': self._get_commit(),
+                    'created_at': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'results': results,
+                }, output, indent=2)
+
+        if kwargs['compare']:
+            self._compare(kwargs['compare'], results, kwargs['threshold'])
+
+    def _compare(self, baseline_path: str, results: dict, threshold: float) -> None:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        comparison = compare_results(baseline['results'], results, threshold)
+        regressions = [row for row in comparison if row[4] == 'regression']
+
+        self.stdout.write('\nCompared with %s' % (baseline.get('commit') or baseline_path))
+
+        for name, before, after, ratio, verdict in comparison:
+            line = '%-32s %10.6f s -> %10.6f s  x%.2f %s' % (name, before, after, ratio, verdict)
+
+            if verdict == 'regression':
+                line = self.style.ERROR(line)
+            elif verdict == 'improvement':
+                line = self.style.SUCCESS(line)
+
+            self.stdout.write(line)
+
+        if regressions:
+            raise CommandError('%i benchmarks regressed more than %i%%' % (len(regressions), threshold * 100))
+
+    @staticmethod
+    def _get_commit() -> str:
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
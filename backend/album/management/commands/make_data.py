@@ -1,38 +1,151 @@
 import os
 import random
 import string
+from concurrent.futures import ProcessPoolExecutor
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.management import BaseCommand
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError
+from django.db import connections, transaction
 
-from backend.album.models import Photo
+from backend.album.imaging import make_synthetic_image, render_renditions
+from backend.album.models import Photo, get_derivative_filename, photo_leaderboard
+from backend.album.response_cache import PHOTOS_SCOPE, response_cache
+from backend.album.storage import get_content_path, photo_storage
+from backend.album.utils import file_checksum
 
 User = get_user_model()
-BASE_DIR = settings.BASE_DIR
+PHOTO_RENDITIONS = settings.PHOTO_RENDITIONS
+
+VIEWS_DISTRIBUTIONS = {
+    'zero': lambda: 0,
+    'uniform': lambda: random.randint(0, 1000),
+    # Few photos get most of the views, like in production
+    'pareto': lambda: int(random.paretovariate(1.16)) - 1,
+}
 
 
 def random_char(char_num: int) -> str:
     return ''.join(random.choice(string.ascii_letters) for _ in range(char_num))
 
 
+def make_image_files(seed: int, size: tuple, make_derivatives: bool) -> dict:
+    """
+    Save synthetic image and its derivatives to the storage.
+
+    :param seed: image variation
+    :type seed: int
+    :param size: (width, height)
+    :type size: tuple
+    :param make_derivatives: render PHOTO_RENDITIONS too
+    :type make_derivatives: bool
+    :return: Photo field values by field name
+    :rtype: dict
+    """
+
+    image = ContentFile(make_synthetic_image(size, 'JPEG', seed).getvalue())
+    checksum = file_checksum(image)
+    fields = {'image': photo_storage.save(get_content_path(checksum, 'image.jpg'), image), 'checksum': checksum}
+
+    if make_derivatives:
+        files, timings = render_renditions(image, PHOTO_RENDITIONS)
+
+        for file_field_name, (file, file_format) in files.items():
+            file_name = get_derivative_filename(file_field_name, PHOTO_RENDITIONS[file_field_name], 'image.jpg')
+
+            with file:
+                fields[file_field_name] = photo_storage.save(get_content_path(checksum, file_name), file)
+
+    return fields
+
+
 class Command(BaseCommand):
-    help = 'Create initial data'
+    help = 'Create synthetic users and photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help='Number of users to create')
+        parser.add_argument('--photos', type=int, default=1, help='Number of photos to create')
+        parser.add_argument(
+            '--images', type=int, default=1000,
+            help='Number of distinct image files, photos share them when there are more photos'
+        )
+        parser.add_argument('--image-size', type=int, nargs=2, default=(1600, 1200), metavar=('WIDTH', 'HEIGHT'))
+        parser.add_argument(
+            '--views-distribution', choices=sorted(VIEWS_DISTRIBUTIONS), default='pareto',
+            help='Distribution of Photo.views'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of processes, which make images, 1 makes them in this process'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+        parser.add_argument(
+            '--skip-derivatives', action='store_true',
+            help='Do not make cropped_image/webp_image, photos are left pending for make_derivatives'
+        )
 
     def handle(self, *args, **kwargs):
-        image_url = os.path.join(BASE_DIR, 'backend', 'album', 'fixtures', 'sunset.jpg')
-        [
-            User.objects.create(
-                password=random.choice((10000000, 1000000000)),
-                email=random_char(6) + '@gmail.com',
-                username=random_char(10)
-            ) for _ in range(5)
-        ]
-
-        with open(image_url, 'rb') as image:
-            Photo.objects.create(
-                image=SimpleUploadedFile(image_url, image.read()),
-                views=random.choice((0, 100)),
-                creator=random.choice(User.objects.all())
-            )
+        if kwargs['photos'] > 0 and kwargs['images'] < 1:
+            raise CommandError('--images must be at least 1 to create photos')
+
+        self._make_users(kwargs['users'], kwargs['batch_size'])
+        creator_ids = list(User.objects.values_list('pk', flat=True))
+
+        if kwargs['photos'] > 0 and not creator_ids:
+            raise CommandError('--users must be at least 1 to create photos in a database without users')
+
+        images = self._make_images(
+            min(kwargs['images'], kwargs['photos']), tuple(kwargs['image_size']),
+            kwargs['workers'], not kwargs['skip_derivatives']
+        )
+        views = VIEWS_DISTRIBUTIONS[kwargs['views_distribution']]
+        processing_state = Photo.ProcessingState.PENDING if kwargs['skip_derivatives'] else Photo.ProcessingState.READY
+        batch = []
+
+        for index in range(kwargs['photos']):
+            batch.append(Photo(
+                title=random_char(10), creator_id=random.choice(creator_ids), views=views(),
+                processing_state=processing_state, **images[index % len(images)]
+            ))
+
+            if len(batch) == kwargs['batch_size'] or index == kwargs['photos'] - 1:
+                # bulk_create neither sends post_save nor enqueues derivatives
+                with transaction.atomic():
+                    Photo.objects.bulk_create(batch)
+                batch = []
+
+        ranked = photo_leaderboard.rebuild()
+        response_cache.invalidate(PHOTOS_SCOPE)
+
+        self.stdout.write(
+            self.style.SUCCESS('%i users and %i photos created, %i photos ranked' % (
+                kwargs['users'], kwargs['photos'], ranked
+            ))
+        )
+
+    @staticmethod
+    def _make_users(count: int, batch_size: int) -> None:
+        # Users can not log in, so one hash is enough and hashing does not slow down creation
+        password = make_password(None)
+
+        User.objects.bulk_create([
+            User(password=password, email=random_char(6) + '@gmail.com', username=random_char(10) + str(index))
+            for index in range(count)
+        ], batch_size=batch_size)
+
+    @staticmethod
+    def _make_images(count: int, size: tuple, workers: int, make_derivatives: bool) -> list:
+        if not count:
+            return []
+
+        arguments = (range(count), [size] * count, [make_derivatives] * count)
+
+        if workers > 1 and count > 1:
+            # Forked processes must not share database connections
+            connections.close_all()
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(make_image_files, *arguments, chunksize=4))
+        return list(map(make_image_files, *arguments))
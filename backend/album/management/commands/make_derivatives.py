@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from backend.album.models import Photo
+from backend.album.tasks import make_photo_derivatives
+
+
+def process_photo(photo_id: int) -> str:
+    try:
+        Photo.objects.get(pk=photo_id).process_derivatives()
+    except Exception as error:
+        return 'Photo %i: %r' % (photo_id, error)
+    return ''
+
+
+class Command(BaseCommand):
+    help = 'Make missing cropped_image/webp_image for existing photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of processes, 1 processes photos in this process'
+        )
+        parser.add_argument(
+            '--celery', action='store_true',
+            help='Enqueue make_photo_derivatives tasks instead of processing photos here'
+        )
+
+    def handle(self, *args, **kwargs):
+        photo_ids = list(
+            Photo.objects.filter(
+                Q(cropped_image='') | Q(webp_image='') | ~Q(processing_state=Photo.ProcessingState.READY)
+            ).values_list('id', flat=True)
+        )
+
+        if kwargs['celery']:
+            for photo_id in photo_ids:
+                make_photo_derivatives.delay(photo_id)
+
+            self.stdout.write(self.style.SUCCESS('%i photos enqueued' % len(photo_ids)))
+            return
+
+        if kwargs['workers'] > 1:
+            # Forked processes must open their own database connections
+            connections.close_all()
+
+            with ProcessPoolExecutor(max_workers=kwargs['workers']) as executor:
+                errors = [error for error in executor.map(process_photo, photo_ids, chunksize=16) if error]
+        else:
+            errors = [error for error in map(process_photo, photo_ids) if error]
+
+        for error in errors:
+            self.stderr.write(error)
+
+        self.stdout.write(
+            self.style.SUCCESS('%i photos processed, %i failed' % (len(photo_ids), len(errors)))
+        )
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from backend.album.models import photo_leaderboard, photo_views_counter
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered views and rebuild photos leaderboard from Photo.views'
+
+    def handle(self, *args, **kwargs):
+        photo_views_counter.flush()
+        ranked = photo_leaderboard.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS('%i photos ranked by %s' % (ranked, photo_leaderboard.__class__.__name__))
+        )
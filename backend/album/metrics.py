@@ -0,0 +1,51 @@
+"""
+    Contain album metrics.
+"""
+
+from django.dispatch import receiver
+
+from app.metrics import CallbackMetric, Histogram
+from backend.album.counters import counter_flushed
+
+DERIVATIVE_DURATION = Histogram(
+    'album_derivative_duration_seconds', 'Time of image decoding, of every rendition and of movie segment',
+    ('derivative',)
+)
+MOVIE_RENDER_DURATION = Histogram(
+    'album_movie_render_duration_seconds', 'Time of movie encoding by encoder', ('encoder',),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+MOVIE_FRAMES = Histogram(
+    'album_movie_frames', 'Frames of encoded movies by encoder', ('encoder',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+VIEW_COUNTER_FLUSH_LAG = Histogram(
+    'album_counter_flush_lag_seconds', 'Age of the oldest buffered increment, when it is saved', ('field',),
+    buckets=(1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600)
+)
+
+
+def get_cache_requests() -> dict:
+    # Caches import models, which import this module
+    from backend.album.movie_cache import movie_cache
+    from backend.album.response_cache import response_cache
+
+    requests = {}
+
+    for name, stats in (('movie', movie_cache.stats()), ('response', response_cache.stats())):
+        requests[(name, 'hit')] = stats['hits']
+        requests[(name, 'miss')] = stats['misses']
+
+    return requests
+
+
+CACHE_REQUESTS = CallbackMetric(
+    'album_cache_requests_total', 'Hits and misses of movie and response caches shared by processes',
+    ('cache', 'result'), get_cache_requests, 'counter'
+)
+
+
+@receiver(counter_flushed)
+def observe_counter_flush_lag(sender, field_name: str, lag: float = None, **kwargs) -> None:
+    if lag is not None:
+        VIEW_COUNTER_FLUSH_LAG.observe(lag, field=field_name)
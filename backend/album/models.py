@@ -1,32 +1,53 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
 import os
-from io import BytesIO
-from typing import Type
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
 
-from PIL import Image
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-from django.core.files.storage import FileSystemStorage
-from django.db import models
-from django.db.models import QuerySet
+from django.db import models, transaction
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_save
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
 from backend.album.base import SingletonModel
-from backend.album.utils import change_file_extension, make_valid_format
+from backend.album.counters import make_buffered_counter
+from backend.album.imaging import render_renditions
+from backend.album.leaderboards import make_leaderboard
+from backend.album.metrics import DERIVATIVE_DURATION
+from backend.album.movies import get_segment_path, make_segment
+from backend.album.response_cache import response_cache
+from backend.album.storage import get_content_path, photo_storage
+from backend.album.utils import file_checksum
 
 MEDIA_ROOT = settings.MEDIA_ROOT
 MEDIA_URL = settings.MEDIA_URL
+PHOTO_RENDITIONS = settings.PHOTO_RENDITIONS
+PHOTO_FILE_DELETE_DELAY = settings.PHOTO_FILE_DELETE_DELAY
+MOVIE_LINK_TTL = settings.MOVIE_LINK_TTL
+MOVIE_LINK_TOUCH_INTERVAL = settings.MOVIE_LINK_TOUCH_INTERVAL
+MOVIE_CLEANUP_BATCH_SIZE = settings.MOVIE_CLEANUP_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
 
 def upload_to(file: Photo = None, filename: str = '') -> str:
     """
-    upload_to handler.
+    upload_to handler of original images.
+
+    Client file name is dropped, only its extension is kept, so
+    identical uploads get the same content-addressed name.
 
-    :param file: Photo's object
+    :param file: Photo's object with checksum of the image
     :type file: Photo
     :param filename: file name
     :type filename: str
@@ -34,7 +55,58 @@ def upload_to(file: Photo = None, filename: str = '') -> str:
     :rtype: str
     """
 
-    return 'uploads/%s' % filename
+    return get_content_path(file.checksum, 'image' + os.path.splitext(filename)[1].lower())
+
+
+def derivative_upload_to(file: Photo = None, filename: str = '') -> str:
+    """
+    upload_to handler of derivatives, which are placed next to their source.
+
+    :param file: Photo's object with checksum of the image
+    :type file: Photo
+    :param filename: derivative file name, e.g. webp_image.webp
+    :type filename: str
+    :return: New media path to file
+    :rtype: str
+    """
+
+    return get_content_path(file.checksum, filename)
+
+
+def get_derivative_filename(file_field_name: str, rendition: dict, image_name: str) -> str:
+    """
+    Return derivative file name with hash of the rendition options, so
+    derivatives rendered with other PHOTO_RENDITIONS are not reused.
+
+    :param file_field_name: derivative file field name
+    :type file_field_name: str
+    :param rendition: PHOTO_RENDITIONS options of the derivative
+    :type rendition: dict
+    :param image_name: name of the original image, derivatives without format keep its extension
+    :type image_name: str
+    :return: e.g. webp_image.1a2b3c4d.webp
+    :rtype: str
+    """
+
+    options = hashlib.sha256(json.dumps(rendition, sort_keys=True).encode()).hexdigest()[:8]
+
+    if rendition['format']:
+        extension = '.' + rendition['format'].lower()
+    else:
+        extension = os.path.splitext(image_name)[1].lower()
+
+    return '%s.%s%s' % (file_field_name, options, extension)
+
+
+def get_link_expiration():
+    """
+    Return expiration time of PhotoDownloadLink created or accessed now.
+
+    :return: now + MOVIE_LINK_TTL
+    :rtype: datetime
+    """
+
+    return timezone.now() + timedelta(seconds=MOVIE_LINK_TTL)
 
 
 class PhotoDownloadLink(models.Model):
@@ -42,36 +114,186 @@ class PhotoDownloadLink(models.Model):
         PhotoDownloadLink model.
     """
 
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RENDERING = 'rendering', _('Rendering')
+        READY = 'ready', _('Ready')
+        FAILED = 'failed', _('Failed')
+
     file_name = models.CharField(
         max_length=100, verbose_name=_('File name'), editable=False
     )
     file_path = models.CharField(
         max_length=300, verbose_name=_('File path'), editable=False
     )
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING,
+        verbose_name=_('Status'), editable=False
+    )
+    error = models.TextField(
+        blank=True, verbose_name=_('Error'), editable=False
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name=_('Created at')
+    )
+    started_at = models.DateTimeField(
+        null=True, blank=True, verbose_name=_('Started at'), editable=False
+    )
+    finished_at = models.DateTimeField(
+        null=True, blank=True, verbose_name=_('Finished at'), editable=False
+    )
+    cache_key = models.CharField(
+        max_length=64, blank=True, db_index=True, verbose_name=_('Cache key'), editable=False
+    )
+    size = models.BigIntegerField(
+        default=0, verbose_name=_('Size'), editable=False
+    )
+    last_accessed_at = models.DateTimeField(
+        auto_now_add=True, verbose_name=_('Last accessed at')
+    )
+    expires_at = models.DateTimeField(
+        default=get_link_expiration, db_index=True, verbose_name=_('Expires at'), editable=False
+    )
 
     @classmethod
-    def make_link(cls) -> PhotoDownloadLink:
+    def make_link(cls, cache_key: str = '', extension: str = '.webm') -> PhotoDownloadLink:
         """
-        Make unique path link to movie.webm file.
+        Make unique path link to movie file.
+
+        The path is a random name in sharded directories, so it does not
+        probe names in a growing directory. The file is reserved on disk
+        right away, so links created concurrently while their movies are
+        still rendering never share a path.
 
+        :param cache_key: MovieCache key of the movie
+        :type cache_key: str
+        :param extension: movie file extension
+        :type extension: str
         :return: PhotoDownloadLink object
         :rtype: PhotoDownloadLink
         """
 
-        videos_path = os.path.join(MEDIA_ROOT, 'videos')
+        token = uuid.uuid4().hex
+        file_path = os.path.join(MEDIA_ROOT, 'videos', token[:2], token[2:4], token + extension)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        open(file_path, 'xb').close()
+
+        return cls.objects.create(file_path=file_path, file_name='movie' + extension, cache_key=cache_key)
+
+    @classmethod
+    def delete_expired(cls, batch_size: int = MOVIE_CLEANUP_BATCH_SIZE, max_batches: int = 0) -> dict:
+        """
+        Delete expired links and their files in batches.
+
+        Rendering links are kept, their files are still written.
+
+        :param batch_size: links deleted by one query
+        :type batch_size: int
+        :param max_batches: number of batches after which deletion stops, 0 deletes all expired links
+        :type max_batches: int
+        :return: numbers of deleted links and files and reclaimed bytes
+        :rtype: dict
+        """
+
+        result = {'links': 0, 'files': 0, 'bytes': 0}
+        batches = 0
+
+        while not max_batches or batches < max_batches:
+            batch = list(
+                cls.objects.filter(
+                    expires_at__lte=timezone.now()
+                ).exclude(
+                    status=cls.Status.RENDERING
+                ).order_by('expires_at').values_list('pk', 'file_path')[:batch_size]
+            )
+
+            if not batch:
+                break
+
+            for pk, file_path in batch:
+                try:
+                    size = os.path.getsize(file_path)
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    continue
+
+                result['files'] += 1
+                result['bytes'] += size
 
-        if not os.path.isdir(videos_path):
-            os.mkdir(videos_path)
+            result['links'] += cls.objects.filter(pk__in=[pk for pk, file_path in batch]).delete()[0]
+            batches += 1
+
+        return result
+
+    @property
+    def is_ready(self) -> bool:
+        return self.status == self.Status.READY
+
+    @property
+    def render_time(self):
+        """
+        Time spent on rendering or None if rendering is not finished.
+
+        :return: rendering duration
+        :rtype: Optional[timedelta]
+        """
 
-        file_system_storage = FileSystemStorage()
-        original_filepath = os.path.join(videos_path, 'movie.webm')
-        unique_filepath = file_system_storage.get_available_name(original_filepath)
-        file_name = unique_filepath.split('/')[-1]
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
 
-        return cls.objects.create(
-            file_path=unique_filepath, file_name=file_name
+    def touch(self) -> bool:
+        """
+        Update last access time and prolong expiration without saving other fields.
+
+        Downloads are read-only, so the link is written at most once per
+        MOVIE_LINK_TOUCH_INTERVAL, and concurrent downloads update it once.
+
+        :return: True if the link was updated
+        :rtype: bool
+        """
+
+        now = timezone.now()
+        accessed_before = now - timedelta(seconds=MOVIE_LINK_TOUCH_INTERVAL)
+
+        if self.last_accessed_at and self.last_accessed_at > accessed_before:
+            return False
+
+        self.last_accessed_at = now
+        self.expires_at = get_link_expiration()
+
+        updated = PhotoDownloadLink.objects.filter(pk=self.pk, last_accessed_at__lte=accessed_before).update(
+            last_accessed_at=self.last_accessed_at, expires_at=self.expires_at
         )
 
+        return bool(updated)
+
+    def mark_rendering(self) -> None:
+        self._set_status(self.Status.RENDERING, started_at=timezone.now())
+
+    def mark_ready(self) -> None:
+        self._set_status(self.Status.READY, finished_at=timezone.now())
+
+    def mark_failed(self, error: str = '') -> None:
+        self._set_status(self.Status.FAILED, finished_at=timezone.now(), error=error)
+
+    def _set_status(self, status: str, **fields) -> None:
+        """
+        Change status and save only changed fields.
+
+        :param status: new status
+        :type status: str
+        :param fields: other fields to update
+        :type fields: dict
+        """
+
+        fields['status'] = status
+
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+        self.save(update_fields=list(fields))
+
     def __str__(self):
         return 'Download %s' % self.file_path
 
@@ -99,77 +321,299 @@ class BestPhotoNotification(SingletonModel):
         verbose_name_plural = _('Best photo notifications')
 
 
+class CounterBatch(models.Model):
+    """
+        Batch of buffered counter increments, which is saved to the
+        database. It is recorded in the transaction of the UPDATE, so a
+        batch, which stays in the buffer after a failed commit, is not
+        applied twice.
+    """
+
+    key = models.CharField(
+        max_length=255, verbose_name=_('Counter key')
+    )
+    batch = models.CharField(
+        max_length=32, unique=True, verbose_name=_('Batch')
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name=_('Created at')
+    )
+
+    def __str__(self):
+        return '%s %s' % (self.key, self.batch)
+
+    class Meta:
+        ordering = ('id',)
+        verbose_name = _('Counter batch')
+        verbose_name_plural = _('Counter batches')
+
+
 class Photo(models.Model):
     """
         Photo model.
     """
+
+    class ProcessingState(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        PROCESSING = 'processing', _('Processing')
+        READY = 'ready', _('Ready')
+        FAILED = 'failed', _('Failed')
+
     title = models.CharField(
         max_length=100, verbose_name=_('Title')
     )
     image = models.ImageField(
-        upload_to=upload_to, verbose_name=_('Image')
+        upload_to=upload_to, storage=photo_storage, verbose_name=_('Image')
     )
     creator = models.ForeignKey(
         User, on_delete=models.CASCADE, verbose_name=_('Creator'), related_name='photos'
     )
     cropped_image = models.ImageField(
-        upload_to=upload_to, verbose_name=_('Image mini'), editable=False
+        upload_to=derivative_upload_to, storage=photo_storage, verbose_name=_('Image mini'), editable=False
     )
     webp_image = models.ImageField(
-        upload_to=upload_to, verbose_name=_('Image webp'), editable=False
+        upload_to=derivative_upload_to, storage=photo_storage, verbose_name=_('Image webp'), editable=False
     )
     created_at = models.DateTimeField(
         auto_now_add=True, verbose_name=_('Created at')
     )
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name=_('Updated at')
+    )
     views = models.BigIntegerField(
         default=0, verbose_name=_('Views'), editable=False
     )
+    checksum = models.CharField(
+        max_length=64, blank=True, verbose_name=_('Checksum'), editable=False
+    )
+    processing_state = models.CharField(
+        max_length=10, choices=ProcessingState.choices, default=ProcessingState.PENDING,
+        verbose_name=_('Processing state'), editable=False
+    )
 
     def add_views_count(self) -> bool:
         """
-        Add 1 view and save.
+        Add 1 view to object and to views buffer, which is saved by flush_view_counts task.
 
         :return: True
         :rtype: bool
         """
 
         self.views += 1
-        self.save(update_fields=['views'])
+        photo_views_counter.add(self.pk)
 
         return True
 
     def save(self, *args, **kwargs):
-        if self._is_first_creation():
-            self.prepare_cropped_image()
-            self.prepare_webp_image()
+        if self._is_first_creation() or self._is_image_changed():
+            self.checksum = file_checksum(self.image)
+
+        if kwargs.get('update_fields') is not None:
+            # auto_now is saved only with the other fields, and ETags are made from it
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'}
 
         super().save(*args, **kwargs)
 
-    def prepare_cropped_image(self) -> bool:
+    def process_derivatives(self) -> dict:
         """
-        Prepare cropped image before save.
+        Make missing derivatives and track processing state.
 
-        :return: True
-        :rtype: bool
+        :return: timings of made derivatives in seconds
+        :rtype: dict
         """
 
-        return self._make_image(
-            'cropped_image'
-        )
+        self._set_processing_state(self.ProcessingState.PROCESSING)
+
+        try:
+            timings = self.make_derivatives()
+        except Exception:
+            self._set_processing_state(self.ProcessingState.FAILED)
+            raise
 
-    def prepare_webp_image(self) -> bool:
+        self._set_processing_state(self.ProcessingState.READY)
+
+        return timings
+
+    def make_derivatives(self) -> dict:
         """
-        Prepare webp image before save.
+        Make PHOTO_RENDITIONS, which are not saved yet, and movie segment,
+        if it is not cached, so it is safe to retry.
 
-        :return: True
-        :rtype: bool
+        :return: timings of decoding, of each made rendition and of movie segment in seconds
+        :rtype: dict
         """
 
-        filename = change_file_extension(self.image.name, '.webp')
+        renditions = {
+            file_field_name: rendition
+            for file_field_name, rendition in PHOTO_RENDITIONS.items()
+            if not self._has_file(file_field_name)
+        }
+        timings = {}
 
-        return self._make_image(
-            'webp_image', file_format='WEBP', filename=filename
-        )
+        if renditions:
+            timings.update(self._make_renditions(renditions))
+
+        if not os.path.exists(get_segment_path(self.ensure_checksum())):
+            started_at = time.perf_counter()
+            make_segment(self)
+            timings['movie_segment'] = time.perf_counter() - started_at
+
+        if timings:
+            logger.info('Photo %i derivatives timings: %r', self.pk, timings)
+
+        for derivative, seconds in timings.items():
+            DERIVATIVE_DURATION.observe(seconds, derivative=derivative)
+
+        return timings
+
+    def _make_renditions(self, renditions: dict) -> dict:
+        """
+        Render and save renditions.
+
+        Renditions of identical images, which are already stored, are
+        reused without rendering.
+
+        :param renditions: rendition options by file field name
+        :type renditions: dict
+        :return: timings of decoding and of each rendition in seconds
+        :rtype: dict
+        """
+
+        self.ensure_checksum()
+        missing = {}
+
+        for file_field_name, rendition in renditions.items():
+            name = derivative_upload_to(self, get_derivative_filename(file_field_name, rendition, self.image.name))
+
+            if photo_storage.touch(name):
+                setattr(self, file_field_name, name)
+            else:
+                missing[file_field_name] = rendition
+
+        files, timings = render_renditions(self.image, missing) if missing else ({}, {})
+
+        for file_field_name, (file, file_format) in files.items():
+            file_filename = get_derivative_filename(file_field_name, missing[file_field_name], self.image.name)
+
+            with file:
+                getattr(self, file_field_name).save(file_filename, file, save=False)
+
+        self.save(update_fields=list(renditions))
+
+        return timings
+
+    def ensure_checksum(self) -> str:
+        """
+        Return image checksum, calculating it for photos saved without one.
+
+        :return: sha256 of the image
+        :rtype: str
+        """
+
+        if not self.checksum:
+            self.checksum = file_checksum(self.image)
+            self.updated_at = timezone.now()
+            Photo.objects.filter(pk=self.pk).update(checksum=self.checksum, updated_at=self.updated_at)
+            response_cache.invalidate_photos([self.pk])
+
+        return self.checksum
+
+    @classmethod
+    def bulk_create_photos(cls, photos: list) -> list:
+        """
+        Insert photos with bulk_create.
+
+        bulk_create neither calls save() nor sends post_save, so checksums
+        are calculated here and post_save receivers (derivatives pipeline,
+        leaderboard) are notified after the insert.
+
+        :param photos: unsaved Photo objects with uploaded images
+        :type photos: list
+        :return: saved photos
+        :rtype: list
+        """
+
+        for photo in photos:
+            photo.checksum = file_checksum(photo.image)
+
+        with transaction.atomic():
+            cls.objects.bulk_create(photos)
+
+            if photos and photos[0].pk is None:
+                # Database can not return ids of inserted rows. Identical images share names,
+                # so the newest rows of every name are taken in insertion order.
+                pks = defaultdict(list)
+
+                for name, pk in cls.objects.filter(
+                    image__in={photo.image.name for photo in photos}
+                ).order_by('-pk').values_list('image', 'pk'):
+                    pks[name].append(pk)
+
+                names = Counter(photo.image.name for photo in photos)
+                pks = {name: pks[name][:count][::-1] for name, count in names.items()}
+
+                for photo in photos:
+                    photo.pk = pks[photo.image.name].pop(0)
+
+            for photo in photos:
+                post_save.send(
+                    sender=cls, instance=photo, created=True, update_fields=None,
+                    raw=False, using=photo._state.db
+                )
+
+        return photos
+
+    @classmethod
+    def delete_unreferenced_files(cls, names, min_age: float = None) -> dict:
+        """
+        Delete files, which are not referenced by any photo.
+
+        Identical images share files, so the references are counted
+        over all file fields of all photos before deletion. Uploads,
+        which reuse a file, touch it before their rows are committed,
+        so unreferenced files modified less than min_age seconds ago are
+        postponed instead of deleted.
+
+        :param names: storage names of files of deleted photos
+        :type names: Iterable[str]
+        :param min_age: seconds since modification, PHOTO_FILE_DELETE_DELAY by default
+        :type min_age: Optional[float]
+        :return: deleted and postponed names
+        :rtype: dict
+        """
+
+        names = {name for name in names if name}
+        result = {'deleted': [], 'postponed': []}
+        min_age = PHOTO_FILE_DELETE_DELAY if min_age is None else min_age
+
+        if not names:
+            return result
+
+        file_field_names = ('image', *PHOTO_RENDITIONS)
+        references = Q()
+
+        for file_field_name in file_field_names:
+            references |= Q(**{'%s__in' % file_field_name: names})
+
+        referenced = {
+            name
+            for row in cls.objects.filter(references).values_list(*file_field_names)
+            for name in row
+        }
+
+        for name in sorted(names - referenced):
+            try:
+                age = time.time() - os.path.getmtime(photo_storage.path(name))
+            except FileNotFoundError:
+                continue
+
+            if age < min_age:
+                result['postponed'].append(name)
+            else:
+                photo_storage.delete(name)
+                result['deleted'].append(name)
+
+        return result
 
     @classmethod
     def get_top_photos(cls) -> QuerySet[Photo]:
@@ -182,9 +626,22 @@ class Photo(models.Model):
 
         # Yes, it may be in Manager, but I'm lazy
 
-        return cls.objects.order_by(
-            '-views'
-        ).only('image')[:10]
+        return photo_leaderboard.top(10).only('image', 'checksum')
+
+    @classmethod
+    def get_top_creator_emails(cls, limit: int) -> list:
+        """
+        return emails of creators of top photos by one query.
+
+        :param limit: number of top photos
+        :type limit: int
+        :return: unique emails in photos order
+        :rtype: List[str]
+        """
+
+        photos = photo_leaderboard.top(limit).select_related('creator').only('creator__email')
+
+        return list(dict.fromkeys(photo.creator.email for photo in photos if photo.creator.email))
 
     @classmethod
     def get_top_user_photos(cls, user: User) -> QuerySet[Photo]:
@@ -197,9 +654,7 @@ class Photo(models.Model):
         :rtype: QuerySet[Photo]
         """
 
-        return cls.objects.filter(creator=user).order_by(
-            '-views'
-        ).only('image')[:10]
+        return photo_leaderboard.top(10, user.pk).only('image', 'checksum')
 
     def _is_first_creation(self) -> bool:
         """
@@ -209,52 +664,50 @@ class Photo(models.Model):
         :rtype: bool
         """
 
-        return not bool(
-            self.webp_image and
-            self.cropped_image
-        )
+        return self._state.adding
 
-    def _make_image(
-            self,
-            file_field_name: str,
-            image: Image = None,
-            file_format: str = '',
-            filename: str = ''
-    ) -> bool:
+    def _is_image_changed(self) -> bool:
         """
-        Make image to received file_field_name
+        Check that a new file is assigned to image and is not saved yet.
 
-        :param file_field_name: file field name for which need to save the image
-        :type file_field_name: str
-        :param image: new image logic or None
-        :type image: Type[JpegImagePlugin]
-        :param file_format: upper file format
-        :type file_format: str
-        :param filename: file name
-        :type filename: str
-        :return: True
+        :return: True or False
         :rtype: bool
         """
 
-        filename = filename if filename else self.image.name
-        file_format = (
-            file_format
-            if file_format
-            else make_valid_format(self.image.name.split('.')[-1].upper())
-        )
-        image = image if image else Image.open(self.image)
+        return bool(self.image) and not self.image._committed
 
-        image_io = BytesIO()
+    def _has_file(self, file_field_name: str) -> bool:
+        """
+        Check that file field is set and its file exists.
 
-        image.save(image_io, quality=100, format=file_format)
-        getattr(self, file_field_name).save(filename, ContentFile(image_io.getvalue()), save=False)
+        :param file_field_name: file field name
+        :type file_field_name: str
+        :return: True or False
+        :rtype: bool
+        """
 
-        return True
+        file = getattr(self, file_field_name)
+
+        return bool(file) and file.storage.exists(file.name)
+
+    def _set_processing_state(self, processing_state: str) -> None:
+        self.processing_state = processing_state
+        self.save(update_fields=['processing_state'])
 
     def __str__(self):
         return 'Image %i: %s' % (self.id, self.image.name)
 
     class Meta:
         ordering = ('id',)
+        indexes = (
+            # Keyset pagination orderings, scanned backward for descending ones and for the leaderboard
+            models.Index(fields=('created_at', 'id')),
+            models.Index(fields=('views', 'id')),
+            models.Index(fields=('creator', '-views')),
+        )
         verbose_name = _('Photo')
         verbose_name_plural = _('Photos')
+
+
+photo_views_counter = make_buffered_counter(Photo, 'views', 'updated_at')
+photo_leaderboard = make_leaderboard(Photo, 'views', 'creator')
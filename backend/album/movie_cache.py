@@ -0,0 +1,168 @@
+"""
+    Contain content-keyed cache of rendered movies.
+"""
+
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from backend.album.models import PhotoDownloadLink
+
+MOVIE_ENCODER = settings.MOVIE_ENCODER
+MOVIE_CACHE_MAX_BYTES = settings.MOVIE_CACHE_MAX_BYTES
+MOVIE_RENDER_TIMEOUT = settings.MOVIE_RENDER_TIMEOUT
+MOVIE_FRAME_SIZE = settings.MOVIE_FRAME_SIZE
+MOVIE_FRAME_DURATION = settings.MOVIE_FRAME_DURATION
+
+
+class MovieCache:
+    """
+        Reuse rendered movies for identical photo sequences.
+
+        The key covers ordered photo ids, image checksums and render
+        parameters, so any change of the photos or of the rendering gives
+        a new movie. Ready movies are evicted in LRU order when they take
+        more than max_bytes on disk. Movies, which are not rendered within
+        render_timeout, are failed, so lost tasks do not block their keys.
+    """
+
+    hits_key = 'album:movie_cache:hits'
+    misses_key = 'album:movie_cache:misses'
+
+    def __init__(self, max_bytes: int = MOVIE_CACHE_MAX_BYTES, render_timeout: int = MOVIE_RENDER_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.render_timeout = render_timeout
+
+    @staticmethod
+    def make_key(photos) -> str:
+        """
+        Make cache key of movie.
+
+        :param photos: photos in frame order
+        :type photos: Iterable[Photo]
+        :return: hex digest
+        :rtype: str
+        """
+
+        key = hashlib.sha256(
+            repr((MOVIE_ENCODER, MOVIE_FRAME_SIZE, MOVIE_FRAME_DURATION)).encode()
+        )
+
+        for photo in photos:
+            key.update(('%i:%s;' % (photo.id, photo.ensure_checksum())).encode())
+
+        return key.hexdigest()
+
+    def get(self, key: str):
+        """
+        Return ready or still rendering link with received key, which is not expired.
+
+        Links, which are pending or rendering longer than render_timeout, are marked failed and missed.
+
+        :param key: cache key
+        :type key: str
+        :return: PhotoDownloadLink object or None
+        :rtype: Optional[PhotoDownloadLink]
+        """
+
+        now = timezone.now()
+        # Expired links are left to delete_expired_movies
+        link = PhotoDownloadLink.objects.filter(
+            cache_key=key, expires_at__gt=now
+        ).exclude(
+            status=PhotoDownloadLink.Status.FAILED
+        ).order_by('-id').first()
+
+        if link is not None and link.is_ready and not os.path.isfile(link.file_path):
+            link.delete()
+            link = None
+
+        if link is not None and not link.is_ready and (
+                (link.started_at or link.created_at) <= now - timedelta(seconds=self.render_timeout)
+        ):
+            link.mark_failed('Rendering timed out')
+            link = None
+
+        if link is None:
+            self._increment(self.misses_key)
+            return None
+
+        link.touch()
+        self._increment(self.hits_key)
+
+        return link
+
+    def add(self, link: PhotoDownloadLink) -> int:
+        """
+        Account rendered movie and evict old ones.
+
+        :param link: ready PhotoDownloadLink object
+        :type link: PhotoDownloadLink
+        :return: freed bytes
+        :rtype: int
+        """
+
+        link.size = os.path.getsize(link.file_path)
+        link.save(update_fields=['size'])
+
+        return self.evict(keep=link)
+
+    def evict(self, keep: PhotoDownloadLink = None) -> int:
+        """
+        Delete least recently used movies until they fit max_bytes.
+
+        :param keep: PhotoDownloadLink which must not be evicted
+        :type keep: PhotoDownloadLink
+        :return: freed bytes
+        :rtype: int
+        """
+
+        links = PhotoDownloadLink.objects.filter(status=PhotoDownloadLink.Status.READY)
+        excess = (links.aggregate(total=Sum('size'))['total'] or 0) - self.max_bytes
+        freed = 0
+
+        if keep is not None:
+            links = links.exclude(pk=keep.pk)
+
+        for link in links.order_by('last_accessed_at').only('file_path', 'size').iterator():
+            if freed >= excess:
+                break
+
+            if os.path.isfile(link.file_path):
+                os.remove(link.file_path)
+
+            link.delete()
+            freed += link.size
+
+        return freed
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters.
+
+        :return: counters
+        :rtype: dict
+        """
+
+        counters = cache.get_many((self.hits_key, self.misses_key))
+        hits = counters.get(self.hits_key, 0)
+        misses = counters.get(self.misses_key, 0)
+
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    @staticmethod
+    def _increment(key: str) -> None:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+movie_cache = MovieCache()
@@ -0,0 +1,227 @@
+"""
+    Contain movie renderer.
+
+    Every photo is encoded once to a one frame segment, which is cached
+    by image checksum, and movies are assembled by stream copy
+    concatenation of segments without re-encoding.
+"""
+
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fractions import Fraction
+
+from django.conf import settings
+from moviepy.config import get_setting
+
+from backend.album.imaging import render_frame
+
+MOVIE_FRAME_SIZE = settings.MOVIE_FRAME_SIZE
+MOVIE_FRAME_DURATION = settings.MOVIE_FRAME_DURATION
+MOVIE_SEGMENTS_ROOT = settings.MOVIE_SEGMENTS_ROOT
+MOVIE_RENDER_WORKERS = settings.MOVIE_RENDER_WORKERS
+
+
+class MovieRenderError(Exception):
+    """
+        ffmpeg could not render a movie.
+    """
+
+
+def make_movie(images, movie_path: str, workers: int = MOVIE_RENDER_WORKERS) -> int:
+    """
+    Assemble .webm slideshow from segments of photos.
+
+    Missing segments are encoded first by up to workers at a time, so
+    memory depends on the number of workers, not of photos.
+
+    :param images: Photo's QuerySet or list of photos in frame order
+    :type images: Iterable[Photo]
+    :param movie_path: output file path
+    :type movie_path: str
+    :param workers: number of segments encoded in parallel
+    :type workers: int
+    :return: number of frames
+    :rtype: int
+    :raises MovieRenderError: if there are no frames or ffmpeg fails
+    """
+
+    segment_paths = make_segments(images, workers)
+
+    if not segment_paths:
+        raise MovieRenderError('No frames to render')
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt') as playlist:
+        for segment_path in segment_paths:
+            playlist.write("file '%s'\n" % segment_path.replace("'", "'\\''"))
+
+        playlist.flush()
+        _run_ffmpeg([
+            '-f', 'concat', '-safe', '0', '-i', playlist.name, '-c', 'copy', '-f', 'webm', movie_path,
+        ])
+
+    return len(segment_paths)
+
+
+def make_segments(images, workers: int = MOVIE_RENDER_WORKERS) -> list:
+    """
+    Return segment paths of photos, encoding missing segments in parallel.
+
+    Workers are threads: Pillow releases the GIL while it decodes and
+    resizes, every segment is encoded by its own ffmpeg process, and
+    threads can be started inside daemonic Celery worker processes,
+    unlike a process pool. Only file paths cross thread boundaries.
+
+    :param images: photos in frame order
+    :type images: Iterable[Photo]
+    :param workers: number of segments encoded in parallel
+    :type workers: int
+    :return: segment paths in frame order
+    :rtype: List[str]
+    """
+
+    images = list(images)
+    missing = {}
+
+    for photo in images:
+        segment_path = get_segment_path(photo.ensure_checksum())
+
+        if not os.path.exists(segment_path):
+            missing.setdefault(segment_path, photo)
+
+    if len(missing) > 1 and workers > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            # list() raises the first error of workers
+            list(executor.map(make_segment, missing.values()))
+    else:
+        for photo in missing.values():
+            make_segment(photo)
+
+    return [get_segment_path(photo.ensure_checksum()) for photo in images]
+
+
+def make_segment(photo) -> str:
+    """
+    Return path of photo segment, encoding it if it is not cached yet.
+
+    :param photo: Photo with image and checksum
+    :type photo: Photo
+    :return: segment path
+    :rtype: str
+    """
+
+    segment_path = get_segment_path(photo.ensure_checksum())
+
+    if os.path.exists(segment_path):
+        return segment_path
+
+    os.makedirs(MOVIE_SEGMENTS_ROOT, exist_ok=True)
+    # Segment is encoded to a temporary file and renamed, so concurrent workers never see partial files
+    file_descriptor, temporary_path = tempfile.mkstemp(suffix='.webm', dir=MOVIE_SEGMENTS_ROOT)
+    os.close(file_descriptor)
+
+    try:
+        encode_frames([render_frame(photo.image.path, MOVIE_FRAME_SIZE)], temporary_path)
+        os.replace(temporary_path, segment_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    return segment_path
+
+
+def get_segment_path(checksum: str) -> str:
+    """
+    Return segment path of image with checksum.
+
+    Frame size and duration are a part of the name, so segments are
+    invalidated by changes of the image and of the movie settings.
+
+    :param checksum: sha256 of the image
+    :type checksum: str
+    :return: segment path
+    :rtype: str
+    """
+
+    return os.path.join(MOVIE_SEGMENTS_ROOT, '%s_%ix%i_%s.webm' % (
+        checksum, MOVIE_FRAME_SIZE[0], MOVIE_FRAME_SIZE[1], MOVIE_FRAME_DURATION
+    ))
+
+
+def encode_frames(frames, movie_path: str) -> int:
+    """
+    Encode raw RGB frames of MOVIE_FRAME_SIZE to .webm file.
+
+    Frames are piped to ffmpeg at 1 / MOVIE_FRAME_DURATION fps, so every
+    frame is encoded once and held by the container timestamps.
+
+    :param frames: raw frames in order
+    :type frames: Iterable[bytes]
+    :param movie_path: output file path
+    :type movie_path: str
+    :return: number of frames
+    :rtype: int
+    :raises MovieRenderError: if there are no frames or ffmpeg fails
+    """
+
+    width, height = MOVIE_FRAME_SIZE
+    frame_rate = 1 / Fraction(MOVIE_FRAME_DURATION).limit_denominator(1000)
+    count = 0
+
+    with _start_ffmpeg([
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%ix%i' % (width, height),
+        '-framerate', str(frame_rate), '-i', '-',
+        '-an', '-c:v', 'libvpx', '-b:v', '1M', '-crf', '10', '-pix_fmt', 'yuv420p',
+        '-f', 'webm', movie_path,
+    ]) as (process, stderr):
+        try:
+            for frame in frames:
+                process.stdin.write(frame)
+                count += 1
+        except BrokenPipeError:
+            # ffmpeg exited, its error is reported below
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+
+        if count and process.returncode == 0:
+            return count
+
+        raise MovieRenderError(_read_error(stderr) or 'No frames to render')
+
+
+def _run_ffmpeg(arguments: list) -> None:
+    with _start_ffmpeg(arguments) as (process, stderr):
+        process.stdin.close()
+
+        if process.wait() != 0:
+            raise MovieRenderError(_read_error(stderr))
+
+
+@contextmanager
+def _start_ffmpeg(arguments: list):
+    # stderr goes to a file, a full pipe would block ffmpeg while frames are written
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error'] + arguments,
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr
+        )
+
+        try:
+            yield process, stderr
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+
+def _read_error(stderr) -> str:
+    stderr.seek(0)
+
+    return stderr.read().decode(errors='replace').strip()
@@ -0,0 +1,171 @@
+"""
+    Contain batched sending of notification emails.
+"""
+
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+
+EMAIL_HOST_USER = settings.EMAIL_HOST_USER
+NOTIFICATION_CHUNK_SIZE = settings.NOTIFICATION_CHUNK_SIZE
+NOTIFICATION_RATE_LIMIT = settings.NOTIFICATION_RATE_LIMIT
+NOTIFICATION_RETRIES = settings.NOTIFICATION_RETRIES
+NOTIFICATION_RETRY_DELAY = settings.NOTIFICATION_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationSender:
+    """
+        Send one notification to many recipients.
+
+        Templates are rendered once, every recipient gets its own message,
+        so addresses are not disclosed, and messages are sent in chunks
+        over one connection. Chunks are spaced to keep rate_limit messages
+        per second. Messages are passed to the connection one by one, so
+        after a failure only the failed and the following messages of the
+        chunk are retried on a new connection, and recipients get no
+        duplicates. Only transient errors are retried: lost connections
+        and 4xx replies. Messages, which the server refuses permanently
+        with 5xx replies, are logged and skipped, other permanent errors
+        stop sending.
+    """
+
+    subject = 'New notification!'
+    html_template_name = 'album/notification.html'
+    text_template_name = 'album/base.txt'
+
+    def __init__(
+            self, chunk_size: int = NOTIFICATION_CHUNK_SIZE, rate_limit: float = NOTIFICATION_RATE_LIMIT,
+            retries: int = NOTIFICATION_RETRIES, retry_delay: float = NOTIFICATION_RETRY_DELAY
+    ):
+        self.chunk_size = chunk_size
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    def send(self, emails, context: dict) -> int:
+        """
+        Send notification to emails.
+
+        :param emails: recipient addresses
+        :type emails: Iterable[str]
+        :param context: templates context
+        :type context: dict
+        :return: number of sent messages, refused messages are not counted
+        :rtype: int
+        """
+
+        emails = list(emails)
+        html = get_template(self.html_template_name).render(context)
+        text = get_template(self.text_template_name).render(context)
+        connection = get_connection()
+        sent = 0
+        next_chunk_at = time.monotonic()
+
+        try:
+            for start in range(0, len(emails), self.chunk_size):
+                chunk = emails[start:start + self.chunk_size]
+                time.sleep(max(next_chunk_at - time.monotonic(), 0))
+
+                messages = []
+
+                for email in chunk:
+                    message = EmailMultiAlternatives(
+                        subject=self.subject, body=text, from_email=EMAIL_HOST_USER, to=[email]
+                    )
+                    message.attach_alternative(html, 'text/html')
+                    messages.append(message)
+
+                sent += self._send_chunk(connection, messages)
+
+                if self.rate_limit:
+                    next_chunk_at = time.monotonic() + len(chunk) / self.rate_limit
+        finally:
+            connection.close()
+
+        if sent < len(emails):
+            logger.error('%i of %i notification messages were refused', len(emails) - sent, len(emails))
+
+        return sent
+
+    def _send_chunk(self, connection, messages: list) -> int:
+        """
+        Send messages, reopening the connection and retrying the unsent ones on transient errors.
+
+        :param connection: email backend
+        :type connection: BaseEmailBackend
+        :param messages: messages of the chunk
+        :type messages: List[EmailMessage]
+        :return: number of sent messages
+        :rtype: int
+        """
+
+        attempt = 0
+        index = 0
+        sent = 0
+
+        while index < len(messages):
+            try:
+                # Backends close connections, which send_messages opened, so it is kept open here
+                connection.open()
+                sent += connection.send_messages(messages[index:index + 1]) or 0
+            except (smtplib.SMTPException, OSError) as error:
+                if is_refused(error):
+                    logger.warning('Notification to %s is refused: %r', ', '.join(messages[index].to), error)
+                    index += 1
+                    continue
+
+                attempt += 1
+
+                if attempt > self.retries or not is_transient(error):
+                    raise
+
+                logger.warning(
+                    'Notification failed after %i of %i messages of the chunk, retry %i of %i: %r',
+                    index, len(messages), attempt, self.retries, error
+                )
+                connection.close()
+                time.sleep(self.retry_delay * attempt)
+                continue
+
+            index += 1
+
+        return sent
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Return True, if sending may succeed on retry: connection is lost or the server replied with 4xx.
+
+    :param error: sending error
+    :type error: Exception
+    :rtype: bool
+    """
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+def is_refused(error: Exception) -> bool:
+    """
+    Return True, if the server permanently refused one message, and the following ones can be sent.
+
+    :param error: sending error
+    :type error: Exception
+    :rtype: bool
+    """
+
+    return isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)) and not is_transient(error)
+
+
+notification_sender = NotificationSender()
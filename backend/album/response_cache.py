@@ -0,0 +1,161 @@
+"""
+    Contain cache of serialized API responses with versioned invalidation.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from backend.album.utils import is_cache_shared
+
+RESPONSE_CACHE_TIMEOUT = settings.RESPONSE_CACHE_TIMEOUT
+
+PHOTOS_SCOPE = 'photos'
+
+
+class ResponseCache:
+    """
+        Cache of serialized data, which is never deleted explicitly.
+
+        Keys include version numbers of scopes (the photo collection or
+        one photo). Invalidation increments the versions, so it does not
+        scan keys, and old entries expire by timeout. Versions, which
+        are missing in the cache, start from the current time in
+        nanoseconds, so they never reuse numbers of evicted versions.
+        Process-local caches cannot invalidate entries of other
+        processes, so with them nothing is cached.
+    """
+
+    version_prefix = 'album:response_cache:version:'
+    hits_key = 'album:response_cache:hits'
+    misses_key = 'album:response_cache:misses'
+
+    def __init__(self, timeout: int = RESPONSE_CACHE_TIMEOUT):
+        self.timeout = timeout
+
+    def get_versions(self, *scopes) -> list:
+        """
+        Return versions of scopes.
+
+        :param scopes: scope names
+        :type scopes: str
+        :return: versions in scopes order
+        :rtype: List[int]
+        """
+
+        if not is_cache_shared():
+            return [0] * len(scopes)
+
+        keys = [self.version_prefix + scope for scope in scopes]
+        versions = cache.get_many(keys)
+
+        for key in keys:
+            if key not in versions:
+                cache.add(key, time.time_ns(), timeout=None)
+                versions[key] = cache.get(key)
+
+        return [versions[key] for key in keys]
+
+    def invalidate(self, *scopes) -> None:
+        """
+        Increment versions of scopes.
+
+        :param scopes: scope names
+        :type scopes: str
+        """
+
+        if not is_cache_shared():
+            return
+
+        for scope in scopes:
+            try:
+                cache.incr(self.version_prefix + scope)
+            except ValueError:
+                cache.add(self.version_prefix + scope, time.time_ns(), timeout=None)
+
+    def invalidate_photos(self, photo_ids) -> None:
+        """
+        Increment versions of photos and of the photo collection.
+
+        :param photo_ids: Photo ids
+        :type photo_ids: Iterable[int]
+        """
+
+        self.invalidate(PHOTOS_SCOPE, *(get_photo_scope(photo_id) for photo_id in photo_ids))
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Make cache key of entry, parts must include versions.
+
+        :param parts: values, which identify the entry
+        :type parts: Any
+        :return: cache key
+        :rtype: str
+        """
+
+        return 'album:response_cache:' + hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Return cached entries and count hits and misses.
+
+        :param keys: cache keys
+        :type keys: list
+        :return: entries by key
+        :rtype: dict
+        """
+
+        if not is_cache_shared():
+            return {}
+
+        entries = cache.get_many(keys)
+
+        if entries:
+            self._increment(self.hits_key, len(entries))
+        if len(entries) < len(keys):
+            self._increment(self.misses_key, len(keys) - len(entries))
+
+        return entries
+
+    def set(self, key: str, entry) -> None:
+        self.set_many({key: entry})
+
+    def set_many(self, entries: dict) -> None:
+        if is_cache_shared():
+            cache.set_many(entries, timeout=self.timeout)
+
+    def stats(self) -> dict:
+        """
+        Return hit/miss counters.
+
+        :return: counters
+        :rtype: dict
+        """
+
+        counters = cache.get_many((self.hits_key, self.misses_key))
+        hits = counters.get(self.hits_key, 0)
+        misses = counters.get(self.misses_key, 0)
+
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    @staticmethod
+    def _increment(key: str, delta: int) -> None:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
+
+
+def get_photo_scope(photo_id: int) -> str:
+    return 'photo:%i' % photo_id
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,39 @@
+"""
+    Contain album signal receivers.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from backend.album.counters import counter_flushed
+from backend.album.models import Photo
+from backend.album.response_cache import response_cache
+from backend.album.tasks import delete_unreferenced_photo_files, make_photo_derivatives
+
+PHOTO_RENDITIONS = settings.PHOTO_RENDITIONS
+
+
+@receiver(post_save, sender=Photo)
+def enqueue_photo_derivatives(sender, instance: Photo, created: bool, **kwargs) -> None:
+    if created:
+        transaction.on_commit(lambda: make_photo_derivatives.delay(instance.pk))
+
+
+@receiver(post_delete, sender=Photo)
+def delete_photo_files(sender, instance: Photo, **kwargs) -> None:
+    names = [getattr(instance, file_field_name).name for file_field_name in ('image', *PHOTO_RENDITIONS)]
+    # Files are kept if the deletion is rolled back
+    transaction.on_commit(lambda: delete_unreferenced_photo_files.delay(names))
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def invalidate_photo_responses(sender, instance: Photo, **kwargs) -> None:
+    response_cache.invalidate_photos([instance.pk])
+
+
+@receiver(counter_flushed, sender=Photo)
+def invalidate_counted_photo_responses(sender, counts: dict, **kwargs) -> None:
+    response_cache.invalidate_photos(counts)
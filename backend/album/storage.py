@@ -0,0 +1,92 @@
+"""
+    Contain content-addressed storage of photo files.
+"""
+
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_ROOT = 'uploads'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        File system storage, which names are made from content checksums.
+
+        Files of one image (the original and its derivatives) share a
+        directory named by the checksum of the original and sharded by
+        its first bytes, so directories stay small and identical uploads
+        get identical names. A name, which exists, already has the same
+        content, so it is reused instead of probing for a free name and
+        writing the bytes again. Files are shared, so they are deleted
+        only when no rows reference them (see Photo.delete_unreferenced_files).
+        Reused files are touched, so files, which are referenced by
+        uncommitted rows, are not deleted as unreferenced.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def touch(self, name: str) -> bool:
+        """
+        Update modification time of file, which is reused.
+
+        :param name: storage name
+        :type name: str
+        :return: False if file does not exist
+        :rtype: bool
+        """
+
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+
+        if self.touch(name):
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Temporary file is renamed, so concurrent uploads of the same content never see partial files
+        file_descriptor, temporary_path = tempfile.mkstemp(prefix='.', dir=directory)
+
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+
+            os.replace(temporary_path, full_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+        return name
+
+
+def get_content_path(checksum: str, file_name: str) -> str:
+    """
+    Return storage name of file of image with checksum.
+
+    :param checksum: sha256 of the original image
+    :type checksum: str
+    :param file_name: file name in the image directory, e.g. image.jpg or webp_image.webp
+    :type file_name: str
+    :return: uploads/ab/cd/<checksum>/<file_name>
+    :rtype: str
+    """
+
+    return '%s/%s/%s/%s/%s' % (CONTENT_ROOT, checksum[:2], checksum[2:4], checksum, file_name)
+
+
+photo_storage = ContentAddressedStorage()
@@ -1,19 +1,144 @@
+import logging
+
 from celery import shared_task
+from celery.signals import worker_shutdown
+from django.conf import settings
+
+from backend.album.models import BestPhotoNotification, Photo, PhotoDownloadLink, photo_views_counter
+from backend.album.movie_cache import movie_cache
+from backend.album.encoders import movie_encoder
+from backend.album.notifications import notification_sender
+
+MOVIE_CLEANUP_MAX_BATCHES = settings.MOVIE_CLEANUP_MAX_BATCHES
+PHOTO_FILE_DELETE_DELAY = settings.PHOTO_FILE_DELETE_DELAY
+NOTIFICATION_AUDIENCE_SIZE = settings.NOTIFICATION_AUDIENCE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def send_message() -> int:
+    """
+    Send BestPhotoNotification to creators of NOTIFICATION_AUDIENCE_SIZE top photos.
+
+    :return: number of sent messages
+    :rtype: int
+    """
+
+    emails = Photo.get_top_creator_emails(NOTIFICATION_AUDIENCE_SIZE)
+
+    if not emails:
+        return 0
+
+    return notification_sender.send(emails, {'text': BestPhotoNotification.load().notification_text})
+
+
+@shared_task
+def render_movie(link_id: int, photo_ids: list) -> bool:
+    """
+    Render movie from photos to PhotoDownloadLink file.
+
+    :param link_id: PhotoDownloadLink id
+    :type link_id: int
+    :param photo_ids: Photo ids in frame order
+    :type photo_ids: list
+    :return: True
+    :rtype: bool
+    """
+
+    link = PhotoDownloadLink.objects.get(pk=link_id)
+    link.mark_rendering()
+
+    # Segments are cached by checksum, a deferred field would cost a query per photo
+    photos = Photo.objects.only('image', 'checksum').in_bulk(photo_ids)
+
+    try:
+        movie_encoder.encode([photos[pk] for pk in photo_ids if pk in photos], link.file_path)
+    except Exception as error:
+        link.mark_failed(repr(error))
+        raise
+
+    link.mark_ready()
+    movie_cache.add(link)
+
+    return True
+
 
-from backend.album.models import BestPhotoNotification, Photo
-from backend.album.utils import mail_creator
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def make_photo_derivatives(self, photo_id: int):
+    """
+    Make missing Photo derivatives, retrying on failure.
+
+    :param photo_id: Photo id
+    :type photo_id: int
+    :return: timings of made derivatives or None if photo does not exist
+    :rtype: Optional[dict]
+    """
+
+    photo = Photo.objects.filter(pk=photo_id).first()
+
+    if photo is None:
+        return None
+
+    try:
+        return photo.process_derivatives()
+    except Exception as error:
+        raise self.retry(exc=error)
+
+
+@shared_task(bind=True, max_retries=10)
+def delete_unreferenced_photo_files(self, names: list) -> dict:
+    """
+    Delete files of deleted photos, which are not referenced, retrying
+    recently modified ones after PHOTO_FILE_DELETE_DELAY.
+
+    :param names: storage names of files
+    :type names: list
+    :return: deleted and postponed names
+    :rtype: dict
+    """
+
+    result = Photo.delete_unreferenced_files(names)
+
+    if result['postponed']:
+        raise self.retry(args=(result['postponed'],), countdown=PHOTO_FILE_DELETE_DELAY)
+
+    return result
 
 
 @shared_task
-def send_message() -> bool:
-    text = BestPhotoNotification.load().notification_text
-    emails = list(set([photo.creator.email for photo in Photo.get_top_photos()[:3] if photo]))
-
-    if emails:
-        context = {
-            'text': text
-        }
-
-        mail_creator(emails, context)
-        return True
-    return False
+def flush_view_counts() -> int:
+    """
+    Save buffered photo views.
+
+    :return: number of saved views
+    :rtype: int
+    """
+
+    return photo_views_counter.flush()
+
+
+@shared_task
+def delete_expired_movies() -> dict:
+    """
+    Delete expired PhotoDownloadLinks and their files, at most
+    MOVIE_CLEANUP_MAX_BATCHES batches per run.
+
+    :return: numbers of deleted links and files and reclaimed bytes
+    :rtype: dict
+    """
+
+    result = PhotoDownloadLink.delete_expired(max_batches=MOVIE_CLEANUP_MAX_BATCHES)
+
+    if result['links']:
+        logger.info(
+            'Deleted %i expired movie links and %i files, reclaimed %i bytes',
+            result['links'], result['files'], result['bytes']
+        )
+
+    return result
+
+
+@worker_shutdown.connect
+def flush_view_counts_on_shutdown(**kwargs) -> None:
+    photo_views_counter.flush()
@@ -1,16 +1,87 @@
+import base64
+import glob
+import json
 import os
+import shutil
+import smtplib
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+import imageio_ffmpeg
+import redis
+from PIL import Image, ImageSequence
+from asgiref.sync import async_to_sync
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
+from app.celery import app as celery_app
+from app.instrumentation import QueryCapture, get_endpoint_stats
+from app.metrics import Counter, Histogram, MetricsRegistry
 from backend.album.factories import UserFactory
+from backend.album.benchmarks import BENCHMARKS, compare_results, run_benchmarks
+from backend.album.counters import RedisBufferedCounter
+from backend.album.encoders import MOVIE_ENCODERS, get_content_type, make_movie_encoder
+from backend.album.imaging import make_synthetic_image, render_frame, render_renditions
+from backend.album.models import (
+    BestPhotoNotification, CounterBatch, Photo, PhotoDownloadLink, get_derivative_filename, photo_views_counter
+)
+from backend.album.movie_cache import MovieCache, movie_cache
+from backend.album.notifications import NotificationSender, notification_sender
+from backend.album.response_cache import response_cache
+from backend.album.storage import get_content_path
+from backend.album.tasks import delete_expired_movies, render_movie, send_message
+from backend.api.v1.album.routers import router
+from backend.album.movies import MovieRenderError, encode_frames, make_movie
 
 BASE_DIR = settings.BASE_DIR
-MEDIA_ROOT = settings.MEDIA_ROOT
+
+
+def use_temporary_media(test_case) -> str:
+    """
+    Store files of the test in a temporary MEDIA_ROOT, which is removed after it.
+
+    Stored files are reused by content, so files of earlier runs would skip rendering.
+
+    :param test_case: test case
+    :type test_case: TestCase
+    :return: temporary MEDIA_ROOT
+    :rtype: str
+    """
+
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+
+    settings_override = override_settings(MEDIA_ROOT=directory.name)
+    settings_override.enable()
+    test_case.addCleanup(settings_override.disable)
+
+    for target, value in (
+        ('backend.album.models.MEDIA_ROOT', directory.name),
+        ('backend.api.v1.album.responses.MEDIA_ROOT', directory.name),
+        ('backend.album.movies.MOVIE_SEGMENTS_ROOT', os.path.join(directory.name, 'segments')),
+    ):
+        patcher = mock.patch(target, value)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+    return directory.name
 
 
 class RegistrationTestCase(APITestCase):
@@ -42,8 +113,292 @@ class RegistrationTestCase(APITestCase):
         self.assertIn('auth_token', response.json())
 
 
+class ImagingTestCase(SimpleTestCase):
+    def test_render_renditions(self):
+        source = BytesIO()
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new('RGB', (1600, 1200), 'red').save(source, format='JPEG', exif=exif)
+        source.seek(0)
+
+        files, timings = render_renditions(source, {
+            'small': {'format': '', 'size': (300, 300), 'quality': 90},
+            'webp': {'format': 'WEBP', 'size': (600, 600), 'quality': 90},
+        })
+
+        self.assertEqual(files['small'][1], 'JPEG')
+        self.assertEqual(Image.open(files['small'][0]).size, (225, 300))
+        self.assertEqual(files['webp'][1], 'WEBP')
+        self.assertEqual(Image.open(files['webp'][0]).size, (450, 600))
+        self.assertEqual(set(timings), {'decode', 'small', 'webp'})
+
+    def test_render_default_renditions(self):
+        source = BytesIO()
+        Image.new('RGB', (1600, 1200), 'red').save(source, format='JPEG')
+
+        for renditions, is_drafted in (
+            (settings.PHOTO_RENDITIONS, False),
+            ({'cropped_image': settings.PHOTO_RENDITIONS['cropped_image']}, True),
+        ):
+            source.seek(0)
+
+            with self.subTest(renditions=list(renditions)), mock.patch(
+                    'PIL.JpegImagePlugin.JpegImageFile.draft', autospec=True, side_effect=lambda *args: None
+            ) as draft:
+                render_renditions(source, renditions)
+
+                self.assertEqual(draft.called, is_drafted)
+
+        source.seek(0)
+        files, _ = render_renditions(source, settings.PHOTO_RENDITIONS)
+
+        # cropped_image is bounded by its size, webp_image keeps the source size
+        self.assertEqual(Image.open(files['cropped_image'][0]).size, (800, 600))
+        self.assertEqual(Image.open(files['webp_image'][0]).size, (1600, 1200))
+
+    def test_render_frame(self):
+        source = BytesIO()
+        Image.new('RGB', (400, 600), 'red').save(source, format='PNG')
+        source.seek(0)
+
+        frame = Image.frombytes('RGB', (800, 600), render_frame(source, (800, 600)))
+
+        self.assertEqual(frame.getpixel((0, 0)), (0, 0, 0))
+        self.assertEqual(frame.getpixel((400, 300)), (255, 0, 0))
+
+
+class MovieTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        patcher = mock.patch('backend.album.movies.MOVIE_SEGMENTS_ROOT', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.photos = []
+
+        for color, checksum in (('red', 'a' * 64), ('green', 'b' * 64), ('blue', 'c' * 64)):
+            image_path = os.path.join(self.directory, color + '.png')
+            Image.new('RGB', (400, 300), color).save(image_path)
+            self.photos.append(
+                mock.Mock(**{'image.path': image_path, 'ensure_checksum.return_value': checksum})
+            )
+
+    def test_make_movie(self):
+        movie_path = os.path.join(self.directory, 'movie.webm')
+
+        self.assertEqual(make_movie(self.photos, movie_path), 3)
+        self.assertEqual(
+            imageio_ffmpeg.count_frames_and_secs(movie_path),
+            (3, 3 * settings.MOVIE_FRAME_DURATION)
+        )
+
+    def test_make_movie_in_parallel(self):
+        movie_path = os.path.join(self.directory, 'movie.webm')
+
+        with mock.patch('backend.album.movies.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as executor:
+            self.assertEqual(make_movie(self.photos + self.photos[:1], movie_path, workers=4), 4)
+
+        executor.assert_called_once_with(max_workers=3)
+        self.assertEqual(len(glob.glob(os.path.join(self.directory, '*_*.webm'))), 3)
+
+    def test_make_movie_from_cached_segments(self):
+        make_movie(self.photos[:2], os.path.join(self.directory, 'first.webm'))
+
+        with mock.patch('backend.album.movies.encode_frames', wraps=encode_frames) as encode:
+            make_movie(self.photos[1:], os.path.join(self.directory, 'second.webm'))
+
+        self.assertEqual(encode.call_count, 1)
+
+    def test_make_empty_movie(self):
+        with self.assertRaises(MovieRenderError):
+            make_movie([], os.path.join(self.directory, 'movie.webm'))
+
+    def test_encoders(self):
+        for name in MOVIE_ENCODERS:
+            with self.subTest(encoder=name):
+                encoder = make_movie_encoder(name)
+                movie_path = os.path.join(self.directory, 'movie' + encoder.extension)
+
+                stats = encoder.encode(self.photos, movie_path)
+
+                self.assertEqual(stats.frames, 3)
+                self.assertGreater(stats.frames_per_second, 0)
+                self.assertEqual(get_content_type(movie_path), encoder.content_type)
+                self.assertEqual(
+                    self._read_movie(movie_path),
+                    (3, 3 * settings.MOVIE_FRAME_DURATION, settings.MOVIE_FRAME_SIZE)
+                )
+
+    def test_encoders_without_frames(self):
+        for name in MOVIE_ENCODERS:
+            with self.subTest(encoder=name):
+                encoder = make_movie_encoder(name)
+
+                with self.assertRaises(MovieRenderError):
+                    encoder.encode([], os.path.join(self.directory, 'movie' + encoder.extension))
+
+    @staticmethod
+    def _read_movie(movie_path: str):
+        if movie_path.endswith('.webm'):
+            reader = imageio_ffmpeg.read_frames(movie_path)
+            size = next(reader)['size']
+            reader.close()
+            frames, seconds = imageio_ffmpeg.count_frames_and_secs(movie_path)
+
+            return frames, seconds, size
+
+        with Image.open(movie_path) as image:
+            durations = []
+
+            for frame in ImageSequence.Iterator(image):
+                frame.load()
+                durations.append(frame.info['duration'])
+
+            return len(durations), sum(durations) / 1000, image.size
+
+
+class BenchmarkTestCase(SimpleTestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(['validate_image[JPEG]'], repeat=2)
+
+        self.assertEqual(list(results), ['validate_image[JPEG]'])
+        self.assertEqual(results['validate_image[JPEG]']['repeat'], 2)
+        self.assertEqual(results['validate_image[JPEG]']['errors'], 0)
+
+    def test_benchmark_renditions(self):
+        self.assertEqual(
+            [name for name in BENCHMARKS if name.startswith('render_renditions[JPEG')],
+            ['render_renditions[JPEG]'] + ['render_renditions[JPEG-%s]' % name for name in settings.PHOTO_RENDITIONS]
+        )
+
+    def test_compare_results(self):
+        baseline = {'fast': {'median': 1.0}, 'slow': {'median': 1.0}, 'same': {'median': 1.0}}
+        results = {'fast': {'median': 0.5}, 'slow': {'median': 1.5}, 'same': {'median': 1.05}, 'new': {'median': 1}}
+
+        self.assertEqual(
+            [(name, verdict) for name, *_, verdict in compare_results(baseline, results, threshold=0.1)],
+            [('fast', 'improvement'), ('same', ''), ('slow', 'regression')]
+        )
+
+
+class MetricsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.counter = Counter('test_total', 'Test "counter"', ('name',), registry=self.registry)
+        self.histogram = Histogram('test_seconds', 'Test histogram', buckets=(0.1, 1), registry=self.registry)
+
+    def test_expose(self):
+        self.counter.inc(name='a"b')
+        self.counter.inc(2, name='a"b')
+
+        for value in (0.05, 0.5, 5):
+            self.histogram.observe(value)
+
+        self.assertEqual(self.registry.expose(''), '\n'.join((
+            '# HELP test_total Test "counter"',
+            '# TYPE test_total counter',
+            'test_total{name="a\\"b"} 3.0',
+            '# HELP test_seconds Test histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1.0',
+            'test_seconds_bucket{le="1.0"} 2.0',
+            'test_seconds_bucket{le="+Inf"} 3.0',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3.0',
+        )) + '\n')
+
+    def test_merge_dumps(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.counter.inc(name='a')
+        self.histogram.observe(0.5)
+        self.registry.dump(directory)
+        # Another process
+        self.registry.dump_name = 'other.json'
+        self.counter.inc(name='b')
+
+        exposition = self.registry.expose(directory)
+
+        self.assertIn('test_total{name="a"} 2.0', exposition)
+        self.assertIn('test_total{name="b"} 1.0', exposition)
+        self.assertIn('test_seconds_count 2.0', exposition)
+
+    def test_invalid_labels(self):
+        with self.assertRaises(ValueError):
+            self.counter.inc(other='a')
+
+
+class NotificationTestCase(SimpleTestCase):
+    def test_send_in_chunks_with_retry(self):
+        connection = mock.Mock()
+        # The second message fails, the first one is already accepted by the server
+        connection.send_messages.side_effect = [1, smtplib.SMTPServerDisconnected(), 1, 1, 1, 1]
+        sender = NotificationSender(chunk_size=2, rate_limit=0, retries=1, retry_delay=0)
+
+        with mock.patch('backend.album.notifications.get_connection', return_value=connection):
+            self.assertEqual(sender.send(['%i@site.com' % index for index in range(5)], {'text': 'text'}), 5)
+
+        self.assertEqual(
+            [call.args[0][0].to for call in connection.send_messages.call_args_list],
+            [['0@site.com'], ['1@site.com'], ['1@site.com'], ['2@site.com'], ['3@site.com'], ['4@site.com']]
+        )
+        connection.close.assert_called()
+
+    def test_send_retries_exhausted(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = smtplib.SMTPServerDisconnected()
+        sender = NotificationSender(retries=2, retry_delay=0)
+
+        with mock.patch('backend.album.notifications.get_connection', return_value=connection), \
+                self.assertRaises(smtplib.SMTPServerDisconnected):
+            sender.send(['user@site.com'], {'text': 'text'})
+
+        self.assertEqual(connection.send_messages.call_count, 3)
+
+    def test_send_skips_refused(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [
+            smtplib.SMTPRecipientsRefused({'0@site.com': (550, b'No such user')}),
+            smtplib.SMTPDataError(554, b'Rejected'),
+            smtplib.SMTPRecipientsRefused({'2@site.com': (450, b'Mailbox busy')}), 1,
+            smtplib.SMTPResponseException(421, b'Try later'), 1,
+            1
+        ]
+        sender = NotificationSender(chunk_size=2, rate_limit=0, retries=2, retry_delay=0)
+
+        with mock.patch('backend.album.notifications.get_connection', return_value=connection), \
+                self.assertLogs('backend.album.notifications', 'ERROR') as logs:
+            self.assertEqual(sender.send(['%i@site.com' % index for index in range(5)], {'text': 'text'}), 3)
+
+        self.assertEqual(
+            [call.args[0][0].to for call in connection.send_messages.call_args_list],
+            [['0@site.com'], ['1@site.com'], ['2@site.com'], ['2@site.com'], ['3@site.com'], ['3@site.com'],
+             ['4@site.com']]
+        )
+        self.assertIn('2 of 5', logs.output[-1])
+
+    def test_send_permanent_error(self):
+        connection = mock.Mock()
+        connection.open.side_effect = smtplib.SMTPAuthenticationError(535, b'Authentication failed')
+        sender = NotificationSender(retries=2, retry_delay=0)
+
+        with mock.patch('backend.album.notifications.get_connection', return_value=connection), \
+                self.assertRaises(smtplib.SMTPAuthenticationError):
+            sender.send(['user@site.com'], {'text': 'text'})
+
+        self.assertEqual(connection.open.call_count, 1)
+
+
 class PhotoTestCase(APITestCase):
     def setUp(self):
+        cache.clear()
+        use_temporary_media(self)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
         self.user = UserFactory.create()
         self.token = Token.objects.create(user=self.user)
         self.movie_url = reverse('album-make-movie-from-best-images')
@@ -61,6 +416,124 @@ class PhotoTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_photo_list_pagination(self):
+        self._make_authentication()
+        Photo.objects.bulk_create([
+            Photo(title='photo %i' % views, image='uploads/photo.jpg', creator=self.user, views=views)
+            for views in (5, 3, 3, 1, 0)
+        ])
+        pages = []
+
+        with mock.patch('backend.api.v1.album.pagination.PhotoPagination.page_size', 2):
+            response = self.client.get(self.album_list_url, {'ordering': '-views', 'count': 'true'})
+            self.assertEqual(response.json()['count'], 5)
+
+            while response.json()['next']:
+                pages.append([photo['views'] for photo in response.json()['results']])
+                response = self.client.get(response.json()['next'])
+
+            pages.append([photo['views'] for photo in response.json()['results']])
+            previous_page = self.client.get(response.json()['previous']).json()
+
+        self.assertEqual(pages, [[5, 3], [3, 1], [0]])
+        self.assertEqual([photo['views'] for photo in previous_page['results']], [3, 1])
+        self.assertNotIn('count', previous_page)
+
+    def test_photo_list_page_numbers(self):
+        self._make_authentication()
+        Photo.objects.bulk_create([
+            Photo(title='photo %i' % index, image='uploads/photo.jpg', creator=self.user) for index in range(3)
+        ])
+
+        with mock.patch('backend.api.v1.album.pagination.PhotoPagination.page_size', 2):
+            first_page = self.client.get(self.album_list_url).json()
+            second_page = self.client.get(self.album_list_url, {'page': 2}).json()
+
+        self.assertEqual(first_page['count'], 3)
+        self.assertIn('page=2', first_page['next'])
+        self.assertEqual([photo['title'] for photo in second_page['results']], ['photo 2'])
+        self.assertIsNone(second_page['next'])
+
+    def test_photo_list_invalid_cursor(self):
+        self._make_authentication()
+
+        for ordering, values in (
+            ('created_at', ['not-a-date', 1]),
+            ('created_at', [[1], 1]),
+            ('views', [1, 'not-a-pk']),
+            ('views', [1]),
+        ):
+            with self.subTest(ordering=ordering, values=values):
+                cursor = base64.urlsafe_b64encode(json.dumps([values, False]).encode()).decode()
+                response = self.client.get(self.album_list_url, {'ordering': ordering, 'cursor': cursor})
+
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(
+            self.client.get(self.album_list_url, {'cursor': 'not-base64'}).status_code, status.HTTP_404_NOT_FOUND
+        )
+
+    def test_photo_conditional_get(self):
+        self._make_authentication()
+        photo = Photo.objects.create(
+            title='photo', image=SimpleUploadedFile('photo.jpg', b'photo'), creator=self.user
+        )
+        detail_url = reverse('album-detail', args=(photo.pk,))
+
+        for url in (self.album_list_url, detail_url):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+
+                with mock.patch('rest_framework.serializers.Serializer.to_representation') as to_representation:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertFalse(to_representation.called)
+                self.assertIn('no-cache', response['Cache-Control'])
+
+        etag = self.client.get(detail_url)['ETag']
+        photo_views_counter.flush()
+
+        self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_photo_response_cache(self):
+        self._make_authentication()
+        photo = Photo.objects.create(
+            title='photo', image=SimpleUploadedFile('photo.jpg', b'photo'), creator=self.user
+        )
+
+        with mock.patch('backend.album.response_cache.is_cache_shared', return_value=True):
+            self.client.get(self.album_list_url)
+
+            with mock.patch('rest_framework.serializers.Serializer.to_representation') as to_representation, \
+                    QueryCapture() as capture:
+                response = self.client.get(self.album_list_url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['results'][0]['title'], 'photo')
+            self.assertFalse(to_representation.called)
+            self.assertFalse([sql for sql, params, duration in capture.queries if 'album_photo' in sql])
+            self.assertEqual(response_cache.stats()['hits'], 1)
+
+            photo.title = 'changed'
+            photo.save()
+
+            self.assertEqual(self.client.get(self.album_list_url).json()['results'][0]['title'], 'changed')
+            self.assertEqual(response_cache.stats()['hits'], 1)
+
+    def test_photo_response_cache_is_process_local(self):
+        self._make_authentication()
+        photo = Photo.objects.create(
+            title='photo', image=SimpleUploadedFile('photo.jpg', b'photo'), creator=self.user
+        )
+        self.client.get(self.album_list_url)
+
+        # Other processes would not see the version increment of the local cache
+        Photo.objects.filter(pk=photo.pk).update(title='changed')
+
+        self.assertEqual(self.client.get(self.album_list_url).json()['results'][0]['title'], 'changed')
+        self.assertEqual(response_cache.stats()['hits'], 0)
+
     def test_photo_list_as_unauthorized(self):
         response = self.client.get(self.album_list_url)
 
@@ -72,8 +545,179 @@ class PhotoTestCase(APITestCase):
         response = self._make_file('valid_image')
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertTrue(os.path.isfile(os.path.join(MEDIA_ROOT, 'uploads', 'sunset.jpg')))
-        self.assertTrue(os.path.isfile(os.path.join(MEDIA_ROOT, 'uploads', 'sunset.webp')))
+        self.assertEqual(response.json()['processing_state'], Photo.ProcessingState.PENDING)
+
+        photo = Photo.objects.get(pk=response.json()['id'])
+
+        self.assertEqual(photo.processing_state, Photo.ProcessingState.READY)
+        self.assertEqual(photo.image.name, get_content_path(photo.checksum, 'image.jpg'))
+        self.assertEqual(photo.webp_image.name, get_content_path(
+            photo.checksum, get_derivative_filename('webp_image', settings.PHOTO_RENDITIONS['webp_image'], 'image.jpg')
+        ))
+        self.assertTrue(os.path.isfile(photo.image.path))
+        self.assertTrue(os.path.isfile(photo.webp_image.path))
+
+    def test_duplicate_photo_files(self):
+        content = b'duplicate %f' % time.time()
+        photos = [
+            Photo.objects.create(title=title, image=SimpleUploadedFile(title, content), creator=self.user)
+            for title in ('first.jpg', 'second.JPG')
+        ]
+
+        self.assertEqual(photos[0].image.name, photos[1].image.name)
+        self.assertEqual(os.listdir(os.path.dirname(photos[0].image.path)), ['image.jpg'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            photos[0].delete()
+
+        self.assertTrue(os.path.isfile(photos[1].image.path))
+        photos[1].delete()
+        # File was just written, an upload of identical image may reuse it before its row is committed
+        self.assertEqual(
+            Photo.delete_unreferenced_files([photos[1].image.name]),
+            {'deleted': [], 'postponed': [photos[1].image.name]}
+        )
+        self.assertTrue(os.path.isfile(photos[1].image.path))
+
+        with mock.patch('backend.album.models.PHOTO_FILE_DELETE_DELAY', 0):
+            with self.captureOnCommitCallbacks(execute=True):
+                Photo.objects.create(
+                    title='third.jpg', image=SimpleUploadedFile('third.jpg', content), creator=self.user
+                ).delete()
+
+        self.assertFalse(os.path.exists(photos[1].image.path))
+
+    def test_derivative_filename(self):
+        rendition = dict(settings.PHOTO_RENDITIONS['cropped_image'])
+        file_name = get_derivative_filename('cropped_image', rendition, 'image.JPEG')
+
+        self.assertTrue(file_name.startswith('cropped_image.'))
+        self.assertTrue(file_name.endswith('.jpeg'))
+        self.assertEqual(file_name, get_derivative_filename('cropped_image', dict(rendition), 'image.jpeg'))
+
+        rendition['quality'] = 50
+
+        self.assertNotEqual(file_name, get_derivative_filename('cropped_image', rendition, 'image.jpeg'))
+
+    def test_oversized_photo_create(self):
+        self._make_authentication()
+
+        with mock.patch('backend.api.v1.album.validators.ACCEPTED_FILE_SIZE', 1024):
+            response = self._make_file('valid_image')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'image': ['Image size must be not more 1024 bytes']})
+
+    def test_bogus_photo_create(self):
+        self._make_authentication()
+
+        response = self.client.post(self.album_list_url, {
+            'image': SimpleUploadedFile('bogus.jpg', b'not an image ' * 1000),
+            'title': 'test title'
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Image mime must be', response.json()['image'][0])
+
+    def test_make_missing_derivatives(self):
+        self._make_authentication()
+
+        photo_id = self._make_file('valid_image').json()['id']
+        Photo.objects.filter(pk=photo_id).update(
+            webp_image='', processing_state=Photo.ProcessingState.FAILED
+        )
+
+        call_command('make_derivatives', workers=1, stdout=StringIO())
+        photo = Photo.objects.get(pk=photo_id)
+
+        self.assertTrue(photo.webp_image)
+        self.assertEqual(photo.processing_state, Photo.ProcessingState.READY)
+
+    def test_batch_photo_create(self):
+        self._make_authentication()
+
+        with open(self.valid_image, 'rb') as image:
+            content = image.read()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('album-batch-create'), {
+                'images': [
+                    SimpleUploadedFile('first.jpg', content),
+                    SimpleUploadedFile('bogus.jpg', b'not an image ' * 1000),
+                    SimpleUploadedFile('second.jpg', content),
+                ]
+            })
+        results = response.json()['results']
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in results], ['failed', 'created', 'created'])
+        self.assertEqual(
+            set(Photo.objects.filter(pk__in=[results[1]['id'], results[2]['id']]).values_list(
+                'title', 'processing_state'
+            )),
+            {('first', Photo.ProcessingState.READY), ('second', Photo.ProcessingState.READY)}
+        )
+
+    def test_batch_photo_create_from_archive(self):
+        self._make_authentication()
+        archive = BytesIO()
+
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.write(self.valid_image, 'album/sunset.jpg')
+            zip_file.writestr('__MACOSX/album/._sunset.jpg', b'')
+
+        response = self.client.post(reverse('album-batch-create'), {
+            'archive': SimpleUploadedFile('album.zip', archive.getvalue())
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(Photo.objects.get(pk=response.json()['results'][0]['id']).title, 'sunset')
+
+    def test_batch_photo_create_from_large_archive(self):
+        self._make_authentication()
+        archive = BytesIO()
+
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.write(self.valid_image, 'sunset.jpg')
+            zip_file.writestr('zeros.jpg', bytes(1048576))
+
+        for setting, size, field_name in (
+            ('BATCH_UPLOAD_MAX_UNCOMPRESSED_SIZE', 1048576, 'archive'),
+            # Archive is rejected by the upload handler while it is received
+            ('BATCH_UPLOAD_MAX_ARCHIVE_SIZE', 1024, 'archive'),
+        ):
+            with self.subTest(setting=setting), mock.patch(
+                    'backend.api.v1.album.validators.' + setting, size
+            ):
+                response = self.client.post(reverse('album-batch-create'), {
+                    'archive': SimpleUploadedFile('album.zip', archive.getvalue())
+                })
+
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(field_name, response.json())
+
+        self.assertFalse(Photo.objects.exists())
+
+    def test_make_data(self):
+        call_command(
+            'make_data', users=2, photos=5, images=2, image_size=(64, 48), workers=1,
+            views_distribution='uniform', batch_size=2, stdout=StringIO()
+        )
+        photos = Photo.objects.all()
+
+        self.assertEqual(photos.count(), 5)
+        self.assertEqual(len({photo.image.name for photo in photos}), 2)
+        self.assertTrue(all(photo.webp_image and photo.checksum for photo in photos))
+        self.assertEqual({photo.processing_state for photo in photos}, {Photo.ProcessingState.READY})
+
+        with self.assertRaisesMessage(CommandError, '--images must be at least 1'):
+            call_command('make_data', users=0, photos=1, images=0, stdout=StringIO())
+
+        get_user_model().objects.all().delete()
+
+        with self.assertRaisesMessage(CommandError, '--users must be at least 1'):
+            call_command('make_data', users=0, photos=1, images=1, stdout=StringIO())
 
     def test_invalid_photo_create(self):
         self._make_authentication()
@@ -82,14 +726,241 @@ class PhotoTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_photo_views_count(self):
+        self._make_authentication()
+        photo_views_counter.flush()
+
+        photo_id = self._make_file('valid_image').json()['id']
+        photo_url = reverse('album-detail', args=(photo_id,))
+
+        self.client.get(photo_url)
+        response = self.client.get(photo_url)
+
+        self.assertEqual(response.json()['views'], 1)
+        self.assertEqual(Photo.objects.get(pk=photo_id).views, 0)
+        self.assertEqual(photo_views_counter.flush(), 2)
+        self.assertEqual(Photo.objects.get(pk=photo_id).views, 2)
+
+    def test_redis_views_count_retry(self):
+        photo = Photo.objects.create(
+            title='photo', image=SimpleUploadedFile('photo.jpg', b'photo'), creator=self.user
+        )
+        client = mock.MagicMock()
+        client.exists.return_value = True
+        client.get.return_value = b'batch'
+        client.hgetall.return_value = {str(photo.pk).encode(): b'2'}
+        # The first flush saves views and fails to delete them from Redis
+        client.delete.side_effect = [redis.ConnectionError, 1]
+
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            counter = RedisBufferedCounter(Photo, 'views')
+
+        with self.assertRaises(redis.ConnectionError):
+            counter.flush()
+
+        self.assertEqual(counter.flush(), 2)
+        self.assertEqual(Photo.objects.get(pk=photo.pk).views, 2)
+        self.assertFalse(CounterBatch.objects.exists())
+
+    def test_top_photos(self):
+        self._make_authentication()
+        other_user = UserFactory.create(email='other@site.com', username='other')
+        photos = []
+
+        for creator, views in ((self.user, 5), (other_user, 10), (self.user, 1)):
+            photo_id = self._make_file('valid_image').json()['id']
+            Photo.objects.filter(pk=photo_id).update(creator=creator, views=views)
+            photos.append(Photo.objects.get(pk=photo_id))
+
+        self.assertEqual(list(Photo.get_top_photos()), [photos[1], photos[0], photos[2]])
+        self.assertEqual(list(Photo.get_top_user_photos(self.user)), [photos[0], photos[2]])
+        self.assertEqual(list(Photo.get_top_photos()[:1]), [photos[1]])
+
+    def test_send_message(self):
+        users = [self.user] + [
+            UserFactory.create(email='user%i@site.com' % index, username='user%i' % index) for index in range(4)
+        ]
+        Photo.objects.bulk_create([
+            Photo(title='photo', image='uploads/photo.jpg', creator=user, views=views)
+            for views, user in enumerate(users + [self.user])
+        ])
+
+        with self.assertNumQueries(1):
+            emails = Photo.get_top_creator_emails(5)
+
+        self.assertEqual(emails, ['user@site.com'] + ['user%i@site.com' % index for index in range(3, -1, -1)])
+
+        with mock.patch('backend.album.tasks.NOTIFICATION_AUDIENCE_SIZE', 4), \
+                mock.patch.object(notification_sender, 'chunk_size', 3):
+            self.assertEqual(send_message(), 4)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(emails[:4]))
+        self.assertEqual({len(message.to) for message in mail.outbox}, {1})
+        self.assertIn(BestPhotoNotification.load().notification_text, mail.outbox[0].alternatives[0][0])
+
+    def test_singleton_cache(self):
+        with mock.patch('backend.album.base.is_cache_shared', return_value=True):
+            notification = BestPhotoNotification.load()
+
+            with self.assertNumQueries(0):
+                self.assertEqual(BestPhotoNotification.load(), notification)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                notification.notification_text = 'saved'
+                notification.save()
+
+            self.assertEqual(BestPhotoNotification.load().notification_text, 'saved')
+
+            # Saved by another process
+            BestPhotoNotification.objects.filter(pk=1).update(notification_text='updated')
+
+            self.assertEqual(BestPhotoNotification.load().notification_text, 'saved')
+
+            BestPhotoNotification.invalidate()
+
+            self.assertEqual(BestPhotoNotification.load().notification_text, 'updated')
+
+    def test_singleton_cache_is_process_local(self):
+        BestPhotoNotification.load()
+        BestPhotoNotification.objects.filter(pk=1).update(notification_text='updated')
+
+        self.assertEqual(BestPhotoNotification.load().notification_text, 'updated')
+
     def test_make_movie(self):
         self._make_authentication()
         self._make_file('valid_image')
 
         response = self.client.post(self.movie_url)
 
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(response.json(), {'id': 1, 'url': 'http://testserver/api/v1/downloads/1/'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['id'], 1)
+        self.assertEqual(response.json()['url'], 'http://testserver/api/v1/downloads/1/')
+        self.assertEqual(response.json()['status_url'], 'http://testserver/api/v1/downloads/1/status/')
+        self.assertEqual(response['Location'], response.json()['status_url'])
+
+    def test_metrics(self):
+        self._make_authentication()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._make_movie()
+
+        self.client.get(reverse('album-detail', args=(Photo.objects.get().pk,)))
+        photo_views_counter.flush()
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        for sample in (
+            'http_request_duration_seconds_count{endpoint="POST album-list",status="201"}',
+            'album_derivative_duration_seconds_count{derivative="webp_image"}',
+            'album_movie_render_duration_seconds_count{encoder="%s"}' % settings.MOVIE_ENCODER,
+            'album_movie_frames_sum{encoder="%s"}' % settings.MOVIE_ENCODER,
+            'celery_task_duration_seconds_count{task="backend.album.tasks.render_movie",state="SUCCESS"}',
+            'album_counter_flush_lag_seconds_count{field="views"}',
+            'album_cache_requests_total{cache="movie",result="miss"}',
+        ):
+            self.assertIn('\n' + sample + ' ', response.content.decode())
+
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+    def test_movie_status(self):
+        self._make_authentication()
+
+        movie_response = self._make_movie()
+        response = self.client.get(movie_response.json()['status_url'])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], PhotoDownloadLink.Status.READY)
+        self.assertIsNotNone(response.json()['started_at'])
+        self.assertIsNotNone(response.json()['finished_at'])
+
+    def test_make_movie_from_cache(self):
+        self._make_authentication()
+        cache.clear()
+
+        movie_response = self._make_movie()
+        response = self.client.post(self.movie_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['id'], movie_response.json()['id'])
+        self.assertEqual(PhotoDownloadLink.objects.count(), 1)
+        self.assertEqual(movie_cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_movie_cache_eviction(self):
+        self._make_authentication()
+
+        first_link = PhotoDownloadLink.objects.get(pk=self._make_movie().json()['id'])
+        first_link.cache_key = 'outdated'
+        first_link.save(update_fields=['cache_key'])
+        second_link = PhotoDownloadLink.objects.get(pk=self.client.post(self.movie_url).json()['id'])
+
+        freed = MovieCache(max_bytes=second_link.size).evict()
+
+        self.assertEqual(freed, first_link.size)
+        self.assertFalse(os.path.isfile(first_link.file_path))
+        self.assertEqual(list(PhotoDownloadLink.objects.all()), [second_link])
+
+    def test_movie_cache_render_timeout(self):
+        link = PhotoDownloadLink.make_link('key')
+        rendering_link = PhotoDownloadLink.make_link('rendering key')
+        rendering_link.mark_rendering()
+        PhotoDownloadLink.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        timed_cache = MovieCache(render_timeout=60)
+
+        self.assertIsNone(timed_cache.get('key'))
+        self.assertEqual(PhotoDownloadLink.objects.get(pk=link.pk).status, PhotoDownloadLink.Status.FAILED)
+        # Rendering time is counted from its start
+        self.assertEqual(timed_cache.get('rendering key'), rendering_link)
+
+        PhotoDownloadLink.objects.filter(pk=rendering_link.pk).update(started_at=timezone.now() - timedelta(hours=1))
+
+        self.assertIsNone(timed_cache.get('rendering key'))
+
+    def test_delete_expired_movies(self):
+        expired_links = [PhotoDownloadLink.make_link() for index in range(3)]
+        link = PhotoDownloadLink.make_link()
+        rendering_link = PhotoDownloadLink.make_link()
+        rendering_link.mark_rendering()
+
+        for expired_link in expired_links:
+            with open(expired_link.file_path, 'wb') as file:
+                file.write(b'movie')
+
+        PhotoDownloadLink.objects.exclude(pk=link.pk).update(expires_at=timezone.now())
+
+        self.assertNotEqual(os.path.dirname(link.file_path), os.path.dirname(expired_links[0].file_path))
+        self.assertEqual(
+            PhotoDownloadLink.delete_expired(batch_size=2, max_batches=1), {'links': 2, 'files': 2, 'bytes': 10}
+        )
+        self.assertEqual(delete_expired_movies(), {'links': 1, 'files': 1, 'bytes': 5})
+        self.assertEqual(set(PhotoDownloadLink.objects.all()), {link, rendering_link})
+        self.assertFalse([expired_link for expired_link in expired_links if os.path.exists(expired_link.file_path)])
+
+    def test_touch_download_link(self):
+        link = PhotoDownloadLink.make_link()
+        expires_at = link.expires_at
+
+        with self.assertNumQueries(0):
+            self.assertFalse(link.touch())
+
+        accessed_at = timezone.now() - timedelta(seconds=settings.MOVIE_LINK_TOUCH_INTERVAL + 1)
+        PhotoDownloadLink.objects.filter(pk=link.pk).update(last_accessed_at=accessed_at)
+        # Concurrent downloads load the link before either of them touches it
+        stale_link, concurrent_link = PhotoDownloadLink.objects.get(pk=link.pk), PhotoDownloadLink.objects.get(pk=link.pk)
+
+        self.assertTrue(stale_link.touch())
+        self.assertFalse(concurrent_link.touch())
+        self.assertGreater(PhotoDownloadLink.objects.get(pk=link.pk).expires_at, expires_at)
+
+    def test_download_not_ready_movie(self):
+        self._make_authentication()
+
+        link = PhotoDownloadLink.make_link()
+        response = self.client.get(reverse('photo_download_link-detail', args=(link.id,)))
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.json()['status'], PhotoDownloadLink.Status.PENDING)
 
     def test_download_movie(self):
         self._make_authentication()
@@ -100,6 +971,30 @@ class PhotoTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.headers['Content-type'], 'audio/webm')
 
+    def test_download_movie_range(self):
+        self._make_authentication()
+
+        url = self._make_movie().json()['url']
+        content = b''.join(self.client.get(url).streaming_content)
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%i' % len(content))
+        self.assertEqual(b''.join(response.streaming_content), content[10:20])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=%i-' % len(content))
+
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_download_movie_not_modified(self):
+        self._make_authentication()
+
+        url = self._make_movie().json()['url']
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
     def _make_authentication(self) -> None:
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
 
@@ -116,8 +1011,179 @@ class PhotoTestCase(APITestCase):
                 'title': 'test title'
             }
 
-            return self.client.post(self.album_list_url, data)
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(self.album_list_url, data)
 
     def _make_movie(self):
         self._make_file('valid_image')
         return self.client.post(self.movie_url)
+
+
+# Maximum number of queries by endpoint, every PhotoViewSet and PhotoDownloadLinkViewSet action must have one
+QUERY_BUDGETS = {
+    # Page numbers count photos, cursor pages (ordering or cursor params) take 2 queries
+    'GET album-list': 3,
+    'POST album-list': 2,
+    'GET album-detail': 2,
+    'PUT album-detail': 3,
+    'PATCH album-detail': 3,
+    'DELETE album-detail': 3,
+    'POST album-batch-create': 5,
+    'POST album-make-movie-from-best-images': 4,
+    'POST album-make-movie-from-best-user-images': 4,
+    'GET photo_download_link-detail': 3,
+    'GET photo_download_link-status': 2,
+}
+# Maximum number of queries by Celery task
+TASK_QUERY_BUDGETS = {
+    'render_movie': 7,
+}
+
+
+class AsyncViewTestCase(APITransactionTestCase):
+    """
+        Async views run in pool threads with connections of their own,
+        which see only committed rows.
+    """
+
+    def setUp(self):
+        cache.clear()
+        use_temporary_media(self)
+        # Rows are committed, so derivatives would be enqueued right away
+        patcher = mock.patch('backend.album.signals.make_photo_derivatives')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Views of retrieved photo are saved while the test database exists
+        self.addCleanup(photo_views_counter.flush)
+
+    def test_async_views(self):
+        user = UserFactory.create()
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        photo = Photo.objects.create(
+            title='photo', image=SimpleUploadedFile('photo.jpg', b'photo'), creator=user
+        )
+        link = PhotoDownloadLink.make_link()
+        link.mark_ready()
+
+        with open(link.file_path, 'wb') as file:
+            file.write(b'movie')
+
+        get = async_to_sync(self.async_client.get)
+
+        for url_name, args in (('album-list', ()), ('album-detail', (photo.pk,))):
+            with self.subTest(url_name=url_name):
+                response = get(reverse('async-' + url_name, args=args), authorization='Token ' + token.key)
+
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.json(), self.client.get(reverse(url_name, args=args)).json())
+
+        url = reverse('async-photo_download_link-detail', args=(link.pk,))
+        response = get(url, authorization='Token ' + token.key)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'movie')
+        self.assertEqual(get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class QueryBudgetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        use_temporary_media(self)
+        self.user = UserFactory.create()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.photo = Photo.objects.create(
+            title='photo', image=SimpleUploadedFile('photo.jpg', b'photo'), creator=self.user
+        )
+        self.link = PhotoDownloadLink.make_link()
+        self.link.mark_ready()
+
+        with open(os.path.join(BASE_DIR, 'backend', 'album', 'fixtures', 'sunset.jpg'), 'rb') as image:
+            self.image = image.read()
+
+        patcher = mock.patch('backend.api.v1.album.views.render_movie')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Views of retrieved photo are saved while the test database exists
+        self.addCleanup(photo_views_counter.flush)
+
+    def test_budgets_cover_all_actions(self):
+        endpoints = {
+            '%s %s' % (method.upper(), pattern.name)
+            for pattern in router.urls if hasattr(pattern.callback, 'actions')
+            for method in pattern.callback.actions if method != 'head'
+        }
+
+        self.assertEqual(endpoints, set(QUERY_BUDGETS))
+
+    def test_query_budgets(self):
+        detail_url = reverse('album-detail', args=(self.photo.pk,))
+        requests = (
+            ('GET album-list', 'get', reverse('album-list'), None),
+            ('POST album-list', 'post', reverse('album-list'), {
+                'title': 'new', 'image': SimpleUploadedFile('new.jpg', self.image)
+            }),
+            ('GET album-detail', 'get', detail_url, None),
+            ('PUT album-detail', 'put', detail_url, {'title': 'put'}),
+            ('PATCH album-detail', 'patch', detail_url, {'title': 'patch'}),
+            ('POST album-batch-create', 'post', reverse('album-batch-create'), {
+                'images': [SimpleUploadedFile('first.jpg', self.image), SimpleUploadedFile('second.jpg', self.image)]
+            }),
+            ('POST album-make-movie-from-best-images', 'post', reverse('album-make-movie-from-best-images'), None),
+            (
+                'POST album-make-movie-from-best-user-images', 'post',
+                reverse('album-make-movie-from-best-user-images'), None
+            ),
+            ('GET photo_download_link-detail', 'get', reverse('photo_download_link-detail', args=(self.link.pk,)), None),
+            ('GET photo_download_link-status', 'get', reverse('photo_download_link-status', args=(self.link.pk,)), None),
+            ('DELETE album-detail', 'delete', detail_url, None),
+        )
+
+        for endpoint, method, url, data in requests:
+            with self.subTest(endpoint=endpoint), self.assertQueryBudget(endpoint):
+                response = getattr(self.client, method)(url, data)
+
+                self.assertLess(response.status_code, 400)
+
+    def test_task_query_budgets(self):
+        photos = [
+            Photo.objects.create(
+                title='photo', creator=self.user,
+                image=SimpleUploadedFile('photo.jpg', make_synthetic_image((64, 48), seed=seed).getvalue())
+            )
+            for seed in range(5)
+        ]
+        link = PhotoDownloadLink.make_link()
+
+        with self.assertQueryBudget('render_movie', TASK_QUERY_BUDGETS):
+            render_movie(link.pk, [photo.pk for photo in photos])
+
+        self.assertTrue(PhotoDownloadLink.objects.get(pk=link.pk).is_ready)
+
+    def test_query_headers(self):
+        with mock.patch('app.instrumentation.QUERY_INSTRUMENTATION_HEADERS', True):
+            response = self.client.get(reverse('album-detail', args=(self.photo.pk,)))
+
+        self.assertEqual(response['X-DB-Queries'], '2')
+        self.assertEqual(response['X-DB-Duplicated-Queries'], '0')
+        self.assertEqual(get_endpoint_stats()['GET album-detail']['duplicates'], 0)
+
+    def test_unresolved_endpoint(self):
+        requests = get_endpoint_stats().get('GET <unresolved>', {'requests': 0})['requests']
+
+        for path in ('/missing/1/', '/missing/2/'):
+            self.assertEqual(self.client.get(path).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(get_endpoint_stats()['GET <unresolved>']['requests'], requests + 2)
+        self.assertFalse([endpoint for endpoint in get_endpoint_stats() if 'missing' in endpoint])
+
+    @contextmanager
+    def assertQueryBudget(self, endpoint: str, budgets: dict = QUERY_BUDGETS):
+        with QueryCapture() as capture:
+            yield capture
+
+        self.assertLessEqual(
+            capture.count, budgets[endpoint],
+            '%s: %i queries\n%s' % (endpoint, capture.count, '\n'.join(sql for sql, *_ in capture.queries))
+        )
+        self.assertEqual(capture.duplicates, {}, endpoint)
@@ -2,62 +2,44 @@
     Contain functions, which do not belong to the class but are used by it.
 """
 
+import hashlib
 
-from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import get_template
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 
-from moviepy.editor import ImageClip, ImageSequenceClip
-from moviepy.video.fx.resize import resize
 
-ACCEPTED_FILE_MIMETYPES = settings.ACCEPTED_FILE_MIMETYPES
-EMAIL_HOST_USER = settings.EMAIL_HOST_USER
-
-
-def change_file_extension(filename: str, extension: str) -> str:
+def is_cache_shared(alias: str = DEFAULT_CACHE_ALIAS) -> bool:
     """
-    Changed file extension to received extension
+    Check that the cache is shared by processes, so versions kept in it invalidate entries of all processes.
 
-    :param filename: filename
-    :type filename: str
-    :param extension: file extension
-    :type extension: str
-    :return: new filename
-    :rtype: str
+    :param alias: cache alias
+    :type alias: str
+    :return: False for process-local and dummy caches
+    :rtype: bool
     """
-    return filename.split('.')[0] + extension
 
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
 
-def make_movie(images, movie_path: str) -> bool:
-    """
-    Resize images to 800x600 and convert to .webm file
 
-    :param images: Photo's QuerySet
-    :type images: QuerySet[Photo]
-    :param movie_path: media movie path
-    :type movie_path: str
-    :return: True
-    :rtype: bool
+def file_checksum(file) -> str:
     """
+    Calculate sha256 of file content without reading it into memory at once.
 
-    frames = []
-    paths = [photo.image.path for photo in images]
+    :param file: django File or FieldFile
+    :type file: File
+    :return: hex digest
+    :rtype: str
+    """
 
-    for path in paths:
-        frame = ImageClip(path).set_position(('center', 'center')).set_duration(1)
-        resized_frame = resize(frame, newsize=(800, 600))
+    checksum = hashlib.sha256()
 
-        frames.append(resized_frame.img)
+    for chunk in file.chunks():
+        checksum.update(chunk)
 
-    ImageSequenceClip(
-        frames, fps=1
-    ).set_duration(
-        images.count()
-    ).write_videofile(
-        movie_path, fps=24
-    )
+    file.seek(0)
 
-    return True
+    return checksum.hexdigest()
 
 
 def make_valid_format(file_format: str) -> str:
@@ -71,19 +53,3 @@ def make_valid_format(file_format: str) -> str:
     """
 
     return file_format if file_format != 'JPG' else 'JPEG'
-
-
-def mail_creator(emails, context):
-    subject = 'New notification!'
-    html_template = get_template('album/notification.html').render(context)
-    txt_template = get_template('album/base.txt')
-
-    message_alternatives = EmailMultiAlternatives(
-        subject=subject,
-        body=txt_template.template.source,
-        from_email=EMAIL_HOST_USER,
-        to=emails
-    )
-
-    message_alternatives.attach_alternative(html_template, "text/html")
-    message_alternatives.send()
@@ -0,0 +1,60 @@
+"""
+    Archive extraction for batch uploads.
+"""
+
+import mimetypes
+import os
+import shutil
+import zipfile
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+# Entries added by archivers, which are not user files
+IGNORED_PREFIXES = ('__MACOSX', '.')
+
+
+def get_archive_entries(zip_file: zipfile.ZipFile) -> list:
+    """
+    Return file entries of zip archive without extracting them.
+
+    :param zip_file: opened archive
+    :type zip_file: ZipFile
+    :return: entries in archive order
+    :rtype: List[ZipInfo]
+    """
+
+    return [
+        info for info in zip_file.infolist()
+        if not info.is_dir() and not _is_ignored(info.filename)
+    ]
+
+
+def extract_archive_entry(zip_file: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """
+    Extract archive entry to a temporary uploaded file.
+
+    Entries are kept until the batch is inserted, so they are never
+    held in memory. Size of extracted data is bounded by info.file_size.
+
+    :param zip_file: opened archive
+    :type zip_file: ZipFile
+    :param info: archive entry
+    :type info: ZipInfo
+    :return: extracted file at start position
+    :rtype: TemporaryUploadedFile
+    """
+
+    name = os.path.basename(info.filename)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    file = TemporaryUploadedFile(name, content_type, info.file_size, None)
+
+    with zip_file.open(info) as entry:
+        shutil.copyfileobj(entry, file)
+
+    file.seek(0)
+    return file
+
+
+def _is_ignored(filename: str) -> bool:
+    return any(part.startswith(IGNORED_PREFIXES) for part in filename.split('/'))
@@ -0,0 +1,65 @@
+"""
+    Album async views.
+
+    Django 3.2 has no async ORM and DRF views are sync only, so these
+    views run the PhotoViewSet and PhotoDownloadLinkViewSet actions in a
+    pool of ASYNC_VIEW_THREADS threads instead of the one thread, which
+    runs sync views of an ASGI process. The pool bounds threads and
+    database connections of the process, requests over it wait in the
+    event loop. A thread is released when the response is rendered, and
+    downloads are streamed by the event loop, so slow clients do not
+    hold threads.
+"""
+
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .views import PhotoDownloadLinkViewSet, PhotoViewSet
+
+ASYNC_VIEW_THREADS = settings.ASYNC_VIEW_THREADS
+
+executor = ThreadPoolExecutor(max_workers=ASYNC_VIEW_THREADS, thread_name_prefix='async-view')
+
+
+def as_async_view(view):
+    """
+    Make async view, which runs sync view in the thread pool.
+
+    :param view: sync view
+    :type view: Callable
+    :return: async view
+    :rtype: Callable
+    """
+
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(_call_view, thread_sensitive=False, executor=executor)(
+            view, request, *args, **kwargs
+        )
+
+    return async_view
+
+
+def _call_view(view, request, *args, **kwargs):
+    # Pool threads keep their connections, which are reused or closed by CONN_MAX_AGE like in sync requests
+    close_old_connections()
+
+    try:
+        response = view(request, *args, **kwargs)
+
+        if hasattr(response, 'render') and callable(response.render):
+            # Data is serialized in this thread, not in the thread of sync views
+            response = response.render()
+
+        return response
+    finally:
+        close_old_connections()
+
+
+photo_list = as_async_view(PhotoViewSet.as_view({'get': 'list'}))
+photo_detail = as_async_view(PhotoViewSet.as_view({'get': 'retrieve'}))
+photo_download_link_detail = as_async_view(PhotoDownloadLinkViewSet.as_view({'get': 'retrieve'}))
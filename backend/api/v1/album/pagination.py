@@ -0,0 +1,239 @@
+"""
+    Album paginations.
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+        Keyset pagination, which filters rows after the last row of
+        the previous page by an indexed (field, pk) ordering instead of
+        OFFSET, and does not COUNT(*) rows unless count is requested.
+
+        Query params: cursor, ordering (one of orderings) and count,
+        which adds approximate total count to the response.
+
+        Requests without cursor and ordering, or with page, are paginated
+        by page_pagination_class, so page number clients keep working.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'count'
+    page_query_param = 'page'
+    page_pagination_class = PageNumberPagination
+    # Ordering name: (field, pk field), both ascending or both descending
+    orderings = {}
+    default_ordering = ''
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_pagination = None
+
+        if not self.is_keyset_request(request):
+            self.page_pagination = self.page_pagination_class()
+            self.page_pagination.page_size = self.page_size
+            rows = self.page_pagination.paginate_queryset(queryset, request, view)
+            self.count = self.page_pagination.page.paginator.count
+
+            return rows
+
+        self.ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+
+        if self.ordering not in self.orderings:
+            raise ValidationError({self.ordering_query_param: _('Ordering must be one of: %s' % ', '.join(
+                self.orderings
+            ))})
+
+        fields = self.orderings[self.ordering]
+        values, is_reversed = self._decode_cursor(request.query_params.get(self.cursor_query_param), queryset.model)
+
+        if is_reversed:
+            fields = tuple(self._reverse_field(field) for field in fields)
+
+        self.count = None
+
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = self.get_approximate_count(queryset)
+
+        if values is not None:
+            queryset = queryset.filter(self._make_filter(fields, values))
+
+        rows = list(queryset.order_by(*fields)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if is_reversed:
+            rows.reverse()
+
+        self.next_row = rows[-1] if rows and (has_more or is_reversed) else None
+        self.previous_row = rows[0] if rows and (has_more if is_reversed else values is not None) else None
+
+        return rows
+
+    def is_keyset_request(self, request) -> bool:
+        """
+        Check that the request asks for a cursor page.
+
+        :param request: paginated request
+        :type request: Request
+        :return: True for cursor or ordering requests without page
+        :rtype: bool
+        """
+
+        params = request.query_params
+
+        return self.page_query_param not in params and (
+            self.cursor_query_param in params or self.ordering_query_param in params
+        )
+
+    def get_paginated_response(self, data):
+        if self.page_pagination is not None:
+            return self.page_pagination.get_paginated_response(data)
+
+        response = {
+            'next': self._make_link(self.next_row, False),
+            'previous': self._make_link(self.previous_row, True),
+            'results': data,
+        }
+
+        if self.count is not None:
+            response['count'] = self.count
+
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'count': {'type': 'integer', 'description': _(
+                    'Exact for page numbers, approximate and only if count is requested for cursors'
+                )},
+                'results': schema,
+            },
+        }
+
+    @staticmethod
+    def get_approximate_count(queryset) -> int:
+        """
+        Return planner row estimate of unfiltered PostgreSQL tables
+        and exact count otherwise.
+
+        :param queryset: paginated QuerySet
+        :type queryset: QuerySet
+        :return: number of rows
+        :rtype: int
+        """
+
+        connection = connections[queryset.db]
+
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+
+            # reltuples is -1 for tables, which were never analyzed
+            if row and row[0] >= 0:
+                return int(row[0])
+
+        return queryset.count()
+
+    def _make_link(self, row, is_reversed: bool):
+        if row is None:
+            return None
+
+        fields = self.orderings[self.ordering]
+        values = [self._get_value(row, field) for field in fields]
+        cursor = base64.urlsafe_b64encode(json.dumps([values, is_reversed]).encode()).decode()
+        url = self.request.build_absolute_uri()
+
+        return replace_query_param(
+            remove_query_param(url, self.count_query_param), self.cursor_query_param, cursor
+        )
+
+    def _decode_cursor(self, cursor, model):
+        """
+        Return values of ordering fields and direction of the cursor.
+
+        Values are cleaned by the model fields, so tampered cursors are
+        not found instead of failing in the query.
+
+        :param cursor: cursor query param
+        :type cursor: Optional[str]
+        :param model: model of paginated rows
+        :type model: Type[Model]
+        :return: values or None for the first page, True for the previous page
+        :rtype: Tuple[Optional[list], bool]
+        """
+
+        if not cursor:
+            return None, False
+
+        fields = self.orderings[self.ordering]
+
+        try:
+            values, is_reversed = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+
+            values = [
+                model._meta.get_field(field.lstrip('-')).clean(value, None) for field, value in zip(fields, values)
+            ]
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(_('Invalid cursor'))
+
+        return values, bool(is_reversed)
+
+    @staticmethod
+    def _make_filter(fields, values) -> Q:
+        # (field, pk) > (value, pk value) for ascending ordering, < for descending one
+        (field, pk_field), (value, pk_value) = fields, values
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        field, pk_field = field.lstrip('-'), pk_field.lstrip('-')
+
+        return Q(**{'%s__%s' % (field, lookup): value}) | Q(
+            **{field: value, '%s__%s' % (pk_field, lookup): pk_value}
+        )
+
+    @staticmethod
+    def _reverse_field(field: str) -> str:
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _get_value(row, field: str):
+        value = getattr(row, field.lstrip('-'))
+
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+class PhotoPagination(KeysetPagination):
+    """
+        Photo pagination by creation time or by views, served by
+        (created_at, id) and (views, id) indexes.
+    """
+
+    orderings = {
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+        'views': ('views', 'id'),
+        '-views': ('-views', '-id'),
+    }
+    default_ordering = 'created_at'
@@ -11,4 +11,4 @@ class IsOwnerOrReadOnlyIfAuthenticated(IsAuthenticated):
     """
 
     def has_object_permission(self, request, view, obj):
-        return request.method in SAFE_METHODS or request.user == obj.creator
+        return request.method in SAFE_METHODS or request.user.pk == obj.creator_id
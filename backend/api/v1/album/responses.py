@@ -0,0 +1,261 @@
+"""
+    File download and conditional responses.
+"""
+
+import hashlib
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from rest_framework import status
+
+DOWNLOAD_CHUNK_SIZE = settings.DOWNLOAD_CHUNK_SIZE
+DOWNLOAD_OFFLOAD_HEADER = settings.DOWNLOAD_OFFLOAD_HEADER
+DOWNLOAD_OFFLOAD_LOCATION = settings.DOWNLOAD_OFFLOAD_LOCATION
+MEDIA_ROOT = settings.MEDIA_ROOT
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    """
+        File-like object which reads only a byte range of file.
+    """
+
+    def __init__(self, file, start: int, length: int):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.file.read(size)
+        self.remaining -= len(data)
+
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class DownloadFileResponse(FileResponse):
+    """
+        FileResponse, which streams file by DOWNLOAD_CHUNK_SIZE chunks.
+    """
+
+    block_size = DOWNLOAD_CHUNK_SIZE
+
+
+def make_etag(*parts) -> str:
+    """
+    Make strong ETag of representation state.
+
+    :param parts: values, which change with the representation
+    :type parts: Any
+    :return: quoted ETag
+    :rtype: str
+    """
+
+    return quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest()[:32])
+
+
+def make_conditional_response(request, etag: str, last_modified, make_response):
+    """
+    Return 304 (or 412) response if the client has current representation
+    and make_response() otherwise.
+
+    Responses must be revalidated by clients and are private, because
+    they depend on the authenticated user.
+
+    :param request: Request
+    :type request: Request
+    :param etag: quoted ETag
+    :type etag: str
+    :param last_modified: modification time or None
+    :type last_modified: Optional[datetime]
+    :param make_response: function, which makes full response
+    :type make_response: Callable[[], HttpResponseBase]
+    :return: Response
+    :rtype: HttpResponseBase
+    """
+
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        response = make_response()
+
+    response['ETag'] = etag
+
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+
+    return response
+
+
+def make_download_response(request, file_path: str, file_name: str, content_type: str):
+    """
+    Make streaming response with Range and conditional GET support.
+
+    The file is sent by the front proxy instead of Django if
+    DOWNLOAD_OFFLOAD_HEADER is set.
+
+    :param request: Request
+    :type request: Request
+    :param file_path: absolute file path
+    :type file_path: str
+    :param file_name: file name for Content-Disposition
+    :type file_name: str
+    :param content_type: file mime type
+    :type content_type: str
+    :return: Response
+    :rtype: HttpResponseBase
+    """
+
+    stat = os.stat(file_path)
+    etag = quote_etag('%x-%x' % (stat.st_mtime_ns, stat.st_size))
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        if DOWNLOAD_OFFLOAD_HEADER:
+            response = _make_offload_response(file_path, content_type)
+        else:
+            response = _make_file_response(
+                request, file_path, stat.st_size, etag, last_modified, content_type
+            )
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = 'attachment; filename="%s"' % file_name
+
+    return response
+
+
+def _make_offload_response(file_path: str, content_type: str) -> HttpResponse:
+    """
+    Make empty response, which tells the front proxy to send the file.
+
+    :param file_path: absolute file path
+    :type file_path: str
+    :param content_type: file mime type
+    :type content_type: str
+    :return: Response
+    :rtype: HttpResponse
+    """
+
+    response = HttpResponse(content_type=content_type)
+
+    if DOWNLOAD_OFFLOAD_HEADER == 'X-Accel-Redirect':
+        response[DOWNLOAD_OFFLOAD_HEADER] = quote(
+            DOWNLOAD_OFFLOAD_LOCATION + os.path.relpath(file_path, MEDIA_ROOT)
+        )
+    else:
+        response[DOWNLOAD_OFFLOAD_HEADER] = file_path
+
+    return response
+
+
+def _make_file_response(
+        request,
+        file_path: str,
+        size: int,
+        etag: str,
+        last_modified: int,
+        content_type: str
+):
+    """
+    Make full or partial streaming response.
+
+    :param request: Request
+    :type request: Request
+    :param file_path: absolute file path
+    :type file_path: str
+    :param size: file size
+    :type size: int
+    :param etag: file ETag
+    :type etag: str
+    :param last_modified: file modification timestamp
+    :type last_modified: int
+    :param content_type: file mime type
+    :type content_type: str
+    :return: Response
+    :rtype: HttpResponseBase
+    """
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+
+    if not if_range or if_range in (etag, http_date(last_modified)):
+        try:
+            byte_range = _parse_range(request.META.get('HTTP_RANGE', ''), size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = 'bytes */%i' % size
+            return response
+
+    file = open(file_path, 'rb')
+
+    if byte_range is None:
+        return DownloadFileResponse(file, content_type=content_type)
+
+    start, end = byte_range
+    response = DownloadFileResponse(
+        FileRange(file, start, end - start + 1),
+        content_type=content_type,
+        status=status.HTTP_206_PARTIAL_CONTENT
+    )
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = 'bytes %i-%i/%i' % (start, end, size)
+
+    return response
+
+
+def _parse_range(header: str, size: int):
+    """
+    Parse single byte range of Range header.
+
+    Multiple and malformed ranges are ignored, so the whole file is sent.
+
+    :param header: Range header
+    :type header: str
+    :param size: file size
+    :type size: int
+    :return: first and last byte positions or None
+    :rtype: Optional[Tuple[int, int]]
+    :raises ValueError: if range is not satisfiable
+    """
+
+    match = RANGE_RE.match(header)
+
+    if not match or match.groups() == ('', ''):
+        return None
+
+    start, end = match.groups()
+
+    if not start:
+        if not int(end):
+            raise ValueError(header)
+        return max(size - int(end), 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+
+    if start >= size:
+        raise ValueError(header)
+    if end < start:
+        return None
+
+    return start, end
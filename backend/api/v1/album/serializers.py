@@ -1,22 +1,53 @@
-import magic
+import os
+import zipfile
 
-from django.conf import settings
 from django.utils.translation import gettext as _
-
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from backend.album.models import Photo, PhotoDownloadLink
+from .archives import extract_archive_entry, get_archive_entries
+from .validators import (
+    UPLOAD_SNIFF_SIZE,
+    validate_archive_size,
+    validate_batch_size,
+    validate_file_size,
+    validate_image_dimensions,
+    validate_mime_type,
+    validate_uncompressed_size,
+)
+
+
+class UploadRejectionsMixin:
+    """
+        Raise errors of files rejected by ImageUploadHandler.
+    """
+
+    # Fields, which rejected files fail, None is all fields
+    rejection_field_names = None
+
+    def to_internal_value(self, data):
+        rejections = getattr(self.context.get('request'), 'upload_rejections', ())
+        field_names = self.fields if self.rejection_field_names is None else self.rejection_field_names
+        errors = {
+            rejection['field_name']: rejection['errors']
+            for rejection in rejections if rejection['field_name'] in field_names
+        }
 
-ACCEPTED_FILE_MIMETYPES = settings.ACCEPTED_FILE_MIMETYPES
-ACCEPTED_FILE_SIZE = settings.ACCEPTED_FILE_SIZE
+        if errors:
+            raise ValidationError(errors)
+        return super().to_internal_value(data)
 
 
-class CreatePhotoSerializer(serializers.ModelSerializer):
+class CreatePhotoSerializer(UploadRejectionsMixin, serializers.ModelSerializer):
     """
         CreatePhotoSerializer serializer.
     """
 
+    # FileField does not read and verify the whole image like ImageField,
+    # validate_image checks only the image header
+    image = serializers.FileField()
+
     def validate_image(self, value):
         """
         Validate image field.
@@ -27,16 +58,11 @@ class CreatePhotoSerializer(serializers.ModelSerializer):
         :rtype: Union[InMemoryUploadedFile, TemporaryUploadedFile]
         """
 
-        mime_type = magic.from_buffer(value.read(), mime=True)
+        validate_file_size(value.size)
+        validate_mime_type(value.read(UPLOAD_SNIFF_SIZE))
+        validate_image_dimensions(value)
+        value.seek(0)
 
-        if mime_type not in ACCEPTED_FILE_MIMETYPES:
-            raise ValidationError(
-                {'image': _('Image mime must be: %s' % ', '.join(ACCEPTED_FILE_MIMETYPES))}
-            )
-        if value.size > ACCEPTED_FILE_SIZE:
-            raise ValidationError(
-                {'image': _('Image size must be not more %i bytes' % ACCEPTED_FILE_SIZE)}
-            )
         return value
 
     class Meta:
@@ -44,6 +70,86 @@ class CreatePhotoSerializer(serializers.ModelSerializer):
         exclude = ('creator',)
 
 
+class BatchCreatePhotoSerializer(UploadRejectionsMixin, serializers.Serializer):
+    """
+        BatchCreatePhotoSerializer serializer.
+
+        Accepts multiple images or a zip archive of images. Every image is
+        validated by CreatePhotoSerializer and titled by its file name.
+        Rejected images are reported by the view, so only rejected
+        archive fails the batch.
+    """
+
+    rejection_field_names = ('archive',)
+
+    images = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False)
+
+    def validate_images(self, value):
+        validate_batch_size(len(value))
+
+        return value
+
+    def validate_archive(self, value):
+        validate_archive_size(value.size)
+
+        if not zipfile.is_zipfile(value):
+            raise ValidationError(_('Archive must be a zip file'))
+
+        value.seek(0)
+
+        with zipfile.ZipFile(value) as zip_file:
+            entries = get_archive_entries(zip_file)
+            validate_batch_size(len(entries))
+            # Declared sizes bound extracted data, so a compression bomb is rejected before extraction
+            validate_uncompressed_size(sum(info.file_size for info in entries))
+
+        value.seek(0)
+        return value
+
+    def validate(self, attrs):
+        if not attrs.get('images') and not attrs.get('archive'):
+            raise ValidationError(_('Images or archive are required'))
+
+        return attrs
+
+    def get_items(self):
+        """
+        Yield batch items, archive entries are extracted one by one.
+
+        :return: file name, CreatePhotoSerializer data or None and errors or None
+        :rtype: Iterator[Tuple[str, Optional[dict], Optional[dict]]]
+        """
+
+        for image in self.validated_data.get('images', ()):
+            yield image.name, self._make_photo_data(image.name, image), None
+
+        archive = self.validated_data.get('archive')
+
+        if archive is None:
+            return
+
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in get_archive_entries(zip_file):
+                try:
+                    # Check declared size before the entry is extracted
+                    validate_file_size(info.file_size)
+                except ValidationError as error:
+                    yield info.filename, None, {'image': error.detail}
+                    continue
+
+                image = extract_archive_entry(zip_file, info)
+
+                yield info.filename, self._make_photo_data(info.filename, image), None
+
+    @staticmethod
+    def _make_photo_data(file_name: str, image) -> dict:
+        title = os.path.splitext(os.path.basename(file_name))[0]
+        max_length = Photo._meta.get_field('title').max_length
+
+        return {'title': title[:max_length], 'image': image}
+
+
 class ListPhotoSerializer(CreatePhotoSerializer):
     """
         ListPhotoSerializer serializer.
@@ -73,8 +179,12 @@ class PhotoDownloadLinkSerializer(serializers.ModelSerializer):
         read_only=True,
         view_name='photo_download_link-detail'
     )
+    status_url = serializers.HyperlinkedIdentityField(
+        read_only=True,
+        view_name='photo_download_link-status'
+    )
 
     class Meta:
         model = PhotoDownloadLink
-        fields = ('id', 'url',)
-        read_only_fields = ('url',)
+        fields = ('id', 'url', 'status_url', 'status', 'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
@@ -0,0 +1,85 @@
+"""
+    Upload handlers.
+"""
+
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+
+from rest_framework.exceptions import ValidationError
+
+from .validators import UPLOAD_SNIFF_SIZE, validate_archive_size, validate_file_size, validate_mime_type
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+        Upload handler, which rejects files while they are received.
+
+        The mime type is sniffed from the first UPLOAD_SNIFF_SIZE bytes and
+        the size is checked with every chunk. Rejected files are not passed
+        to the next handlers, and rejections are saved to
+        request.upload_rejections for the serializers.
+
+        Only image_field_names are validated. Oversized file stops the
+        whole upload unless stop_upload_on_oversize is False, which lets
+        batch uploads skip it and keep the other files. Size of
+        archive_field_names is checked with every chunk too, oversized
+        archive always stops the upload.
+    """
+
+    image_field_names = ('image', 'images')
+    archive_field_names = ('archive',)
+
+    def __init__(self, request=None, stop_upload_on_oversize: bool = True):
+        super().__init__(request)
+        self.head = b''
+        self.is_image = False
+        self.is_archive = False
+        self.stop_upload_on_oversize = stop_upload_on_oversize
+        self.request.upload_rejections = []
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.head = b''
+        self.is_image = field_name in self.image_field_names
+        self.is_archive = field_name in self.archive_field_names
+
+        if content_length is not None and self.is_image:
+            self._validate(validate_file_size, content_length)
+        elif content_length is not None and self.is_archive:
+            self._validate(validate_archive_size, content_length)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.is_archive:
+            self._validate(validate_archive_size, start + len(raw_data))
+
+        if not self.is_image:
+            return raw_data
+
+        self._validate(validate_file_size, start + len(raw_data))
+
+        if len(self.head) < UPLOAD_SNIFF_SIZE:
+            self.head += raw_data[:UPLOAD_SNIFF_SIZE - len(self.head)]
+
+            if len(self.head) == UPLOAD_SNIFF_SIZE:
+                self._validate(validate_mime_type, self.head)
+
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Files shorter than UPLOAD_SNIFF_SIZE are checked by serializers
+        return None
+
+    def _validate(self, validator, value) -> None:
+        try:
+            validator(value)
+        except ValidationError as error:
+            self.request.upload_rejections.append({
+                'field_name': self.field_name,
+                'file_name': self.file_name,
+                'errors': error.detail,
+            })
+
+            if validator is validate_archive_size or (
+                    validator is validate_file_size and self.stop_upload_on_oversize
+            ):
+                raise StopUpload(connection_reset=True)
+            raise SkipFile()
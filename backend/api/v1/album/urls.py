@@ -4,6 +4,7 @@
 
 from django.urls import path, include
 
+from . import async_views
 from .routers import router
 
 urlpatterns = [
@@ -12,5 +13,13 @@ urlpatterns = [
 
     # api/v1/downloads/{pk}/
 
-    path('', include(router.urls))
+    path('', include(router.urls)),
+
+    # Async variants of read and download endpoints for ASGI servers
+    path('async/albums/', async_views.photo_list, name='async-album-list'),
+    path('async/albums/<int:pk>/', async_views.photo_detail, name='async-album-detail'),
+    path(
+        'async/downloads/<int:pk>/', async_views.photo_download_link_detail,
+        name='async-photo_download_link-detail'
+    ),
 ]
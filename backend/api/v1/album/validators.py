@@ -0,0 +1,103 @@
+"""
+    Upload validators, which need only the head of the file.
+"""
+
+import magic
+
+from django.conf import settings
+from django.core.files.images import get_image_dimensions
+from django.utils.translation import gettext as _
+
+from rest_framework.exceptions import ValidationError
+
+ACCEPTED_FILE_MIMETYPES = settings.ACCEPTED_FILE_MIMETYPES
+ACCEPTED_FILE_SIZE = settings.ACCEPTED_FILE_SIZE
+ACCEPTED_IMAGE_MAX_PIXELS = settings.ACCEPTED_IMAGE_MAX_PIXELS
+UPLOAD_SNIFF_SIZE = settings.UPLOAD_SNIFF_SIZE
+BATCH_UPLOAD_MAX_FILES = settings.BATCH_UPLOAD_MAX_FILES
+BATCH_UPLOAD_MAX_ARCHIVE_SIZE = settings.BATCH_UPLOAD_MAX_ARCHIVE_SIZE
+BATCH_UPLOAD_MAX_UNCOMPRESSED_SIZE = settings.BATCH_UPLOAD_MAX_UNCOMPRESSED_SIZE
+
+
+def validate_file_size(size: int) -> None:
+    """
+    Validate file size.
+
+    :param size: file size in bytes
+    :type size: int
+    :raises ValidationError: if file is too big
+    """
+
+    if size > ACCEPTED_FILE_SIZE:
+        raise ValidationError(_('Image size must be not more %i bytes' % ACCEPTED_FILE_SIZE))
+
+
+def validate_mime_type(head: bytes) -> None:
+    """
+    Validate mime type sniffed from the first UPLOAD_SNIFF_SIZE bytes of file.
+
+    :param head: beginning of file
+    :type head: bytes
+    :raises ValidationError: if mime type is not accepted
+    """
+
+    if magic.from_buffer(head[:UPLOAD_SNIFF_SIZE], mime=True) not in ACCEPTED_FILE_MIMETYPES:
+        raise ValidationError(_('Image mime must be: %s' % ', '.join(ACCEPTED_FILE_MIMETYPES)))
+
+
+def validate_image_dimensions(file) -> None:
+    """
+    Validate image dimensions parsed from its header without decoding.
+
+    :param file: uploaded file
+    :type file: Union[InMemoryUploadedFile, TemporaryUploadedFile]
+    :raises ValidationError: if image header is broken or image is too large
+    """
+
+    width, height = get_image_dimensions(file)
+
+    if width is None:
+        raise ValidationError(_('Upload a valid image'))
+    if width * height > ACCEPTED_IMAGE_MAX_PIXELS:
+        raise ValidationError(_('Image must have not more %i pixels' % ACCEPTED_IMAGE_MAX_PIXELS))
+
+
+def validate_batch_size(count: int) -> None:
+    """
+    Validate number of photos in batch upload.
+
+    :param count: number of files
+    :type count: int
+    :raises ValidationError: if batch is too large
+    """
+
+    if count > BATCH_UPLOAD_MAX_FILES:
+        raise ValidationError(_('Batch must have not more %i images' % BATCH_UPLOAD_MAX_FILES))
+
+
+def validate_archive_size(size: int) -> None:
+    """
+    Validate archive size.
+
+    :param size: archive size in bytes
+    :type size: int
+    :raises ValidationError: if archive is too big
+    """
+
+    if size > BATCH_UPLOAD_MAX_ARCHIVE_SIZE:
+        raise ValidationError(_('Archive size must be not more %i bytes' % BATCH_UPLOAD_MAX_ARCHIVE_SIZE))
+
+
+def validate_uncompressed_size(size: int) -> None:
+    """
+    Validate total size of archive entries.
+
+    :param size: sum of uncompressed entry sizes in bytes
+    :type size: int
+    :raises ValidationError: if entries are too big
+    """
+
+    if size > BATCH_UPLOAD_MAX_UNCOMPRESSED_SIZE:
+        raise ValidationError(_(
+            'Uncompressed archive size must be not more %i bytes' % BATCH_UPLOAD_MAX_UNCOMPRESSED_SIZE
+        ))
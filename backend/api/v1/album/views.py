@@ -1,17 +1,23 @@
 """
     Album views.
 """
-from django.http import HttpResponse
 from django.utils.translation import gettext as _
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import viewsets, status, permissions, mixins
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from backend.album.encoders import get_content_type, movie_encoder
 from backend.album.models import Photo, PhotoDownloadLink
-from backend.album.utils import make_movie
+from backend.album.movie_cache import movie_cache
+from backend.album.response_cache import PHOTOS_SCOPE, get_photo_scope, response_cache
+from backend.album.tasks import render_movie
+from .pagination import PhotoPagination
 from .permissions import IsOwnerOrReadOnlyIfAuthenticated
+from .responses import make_conditional_response, make_download_response, make_etag
+from .uploadhandlers import ImageUploadHandler
 from .serializers import (
+    BatchCreatePhotoSerializer,
     UpdatePhotoSerializer,
     CreatePhotoSerializer,
     ListPhotoSerializer,
@@ -31,13 +37,27 @@ class PhotoDownloadLinkViewSet(mixins.RetrieveModelMixin,
     def retrieve(self, request, *args, **kwargs):
         """ Download file. """
 
-        file_path = self.get_object().file_path
-        file_name = self.get_object().file_name
+        link = self.get_object()
 
-        with open(file_path, 'rb') as file:
-            response = HttpResponse(file, content_type='audio/webm')
-            response['Content-Disposition'] = 'attachment; filename="%s"' % file_name
-            return response
+        if not link.is_ready:
+            serializer = PhotoDownloadLinkSerializer(link, context={'request': request})
+
+            return Response(serializer.data, status=status.HTTP_409_CONFLICT)
+
+        link.touch()
+
+        return make_download_response(
+            request, link.file_path, link.file_name, get_content_type(link.file_name)
+        )
+
+    @action(methods=['GET'], detail=True, url_path='status', url_name='status')
+    @swagger_auto_schema(responses={200: PhotoDownloadLinkSerializer()})
+    def render_status(self, request, pk=None):
+        """ Movie rendering status. """
+
+        serializer = PhotoDownloadLinkSerializer(self.get_object(), context={'request': request})
+
+        return Response(serializer.data)
 
 
 class PhotoViewSet(viewsets.ModelViewSet):
@@ -46,20 +66,114 @@ class PhotoViewSet(viewsets.ModelViewSet):
     """
 
     permission_classes = (IsOwnerOrReadOnlyIfAuthenticated,)
+    pagination_class = PhotoPagination
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Files are parsed lazily, so the handler is added after self.action is known
+        drf_request = super().initialize_request(request, *args, **kwargs)
+
+        if request.method == 'POST':
+            request.upload_handlers.insert(0, ImageUploadHandler(
+                request, stop_upload_on_oversize=self.action != 'batch_create'
+            ))
+
+        return drf_request
 
     def get_serializer_class(self):
         if self.action in ['retrieve', 'update', 'partial_update']:
-            if self.get_object().creator == self.request.user:
+            if self.get_object().creator_id == self.request.user.pk:
                 return UpdatePhotoSerializer
         elif self.action == 'create':
             return CreatePhotoSerializer
+        elif self.action == 'batch_create':
+            return BatchCreatePhotoSerializer
         return ListPhotoSerializer
 
+    def get_object(self):
+        # get_serializer_class and the action both need the object, so it is fetched once per request
+        if not hasattr(self, '_object'):
+            self._object = super().get_object()
+
+        return self._object
+
+    def list(self, request, *args, **kwargs):
+        """
+        Photos page.
+
+        Pages are cached until any photo changes, and 304 is returned
+        without serialization if the page has not changed.
+        """
+
+        version, = response_cache.get_versions(PHOTOS_SCOPE)
+        key = response_cache.make_key(
+            'list', version, self.get_serializer_class().__name__, request.accepted_renderer.format,
+            request.build_absolute_uri()
+        )
+        entry = response_cache.get(key)
+
+        if entry is None:
+            page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+            entry = {
+                'etag': make_etag(
+                    self.get_serializer_class().__name__, request.accepted_renderer.format,
+                    request.get_full_path(), self.paginator.count,
+                    [(photo.pk, photo.updated_at) for photo in page]
+                ),
+                'last_modified': max((photo.updated_at for photo in page), default=None),
+            }
+
+            def make_response():
+                entry['data'] = self.get_paginated_response(self._serialize_photos(page)).data
+                response_cache.set(key, entry)
+
+                return Response(entry['data'])
+        else:
+            def make_response():
+                return Response(entry['data'])
+
+        return make_conditional_response(request, entry['etag'], entry['last_modified'], make_response)
+
     def retrieve(self, request, *args, **kwargs):
+        """ Photo, 304 is returned without serialization if the photo has not changed. """
+
         instance = self.get_object()
-        serializer = self.get_serializer(instance)
         instance.add_views_count()
-        return Response(serializer.data)
+        etag = make_etag(
+            self.get_serializer_class().__name__, request.accepted_renderer.format, instance.pk, instance.updated_at
+        )
+
+        return make_conditional_response(
+            request, etag, instance.updated_at, lambda: Response(self._serialize_photos([instance])[0])
+        )
+
+    def _serialize_photos(self, photos) -> list:
+        """
+        Serialize photos, reusing cached data of photos, which have not changed.
+
+        :param photos: photos
+        :type photos: List[Photo]
+        :return: serialized photos in photos order
+        :rtype: list
+        """
+
+        serializer_class = self.get_serializer_class()
+        versions = response_cache.get_versions(*(get_photo_scope(photo.pk) for photo in photos))
+        keys = [
+            response_cache.make_key(
+                'photo', photo.pk, version, serializer_class.__name__, self.request.build_absolute_uri('/')
+            )
+            for photo, version in zip(photos, versions)
+        ]
+        cached = response_cache.get_many(keys)
+        missing = [(key, photo) for key, photo in zip(keys, photos) if key not in cached]
+
+        if missing:
+            data = self.get_serializer([photo for key, photo in missing], many=True).data
+            serialized = {key: item for (key, photo), item in zip(missing, data)}
+            response_cache.set_many(serialized)
+            cached.update(serialized)
+
+        return [cached[key] for key in keys]
 
     def get_queryset(self):
         return Photo.objects.all()
@@ -69,11 +183,61 @@ class PhotoViewSet(viewsets.ModelViewSet):
             creator=self.request.user
         )
 
+    @action(
+        methods=['POST'], detail=False, url_path='batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def batch_create(self, request):
+        """
+        Create photos from multiple images or a zip archive.
+
+        Valid images are inserted with one bulk query and their derivatives
+        are made by Celery workers in parallel. Response has a result of
+        every item and is 207 if only some of them are created.
+        """
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = [
+            {'file_name': rejection['file_name'], 'status': 'failed', 'errors': {'image': rejection['errors']}}
+            for rejection in request.upload_rejections
+        ]
+        photos = []
+
+        for file_name, data, errors in serializer.get_items():
+            if data is not None:
+                photo_serializer = CreatePhotoSerializer(data=data, context={'request': request})
+
+                if photo_serializer.is_valid():
+                    photos.append(Photo(creator=request.user, **photo_serializer.validated_data))
+                    results.append({'file_name': file_name, 'status': 'created', 'photo': photos[-1]})
+                    continue
+
+                errors = photo_serializer.errors
+
+            results.append({'file_name': file_name, 'status': 'failed', 'errors': errors})
+
+        Photo.bulk_create_photos(photos)
+
+        for result in results:
+            if 'photo' in result:
+                result['id'] = result.pop('photo').pk
+
+        if len(photos) == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif photos:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        return Response({'results': results}, status=response_status)
+
     @action(
         methods=['POST'], detail=False, url_path='make_movie',
         permission_classes=(permissions.IsAuthenticated,)
     )
-    @swagger_auto_schema(responses={200: PhotoDownloadLinkSerializer()})
+    @swagger_auto_schema(responses={200: PhotoDownloadLinkSerializer(), 202: PhotoDownloadLinkSerializer()})
     def make_movie_from_best_images(self, request):
         top_photos = Photo.get_top_photos()
 
@@ -83,7 +247,7 @@ class PhotoViewSet(viewsets.ModelViewSet):
         methods=['POST'], detail=False, url_path='make_user_movie',
         permission_classes=(permissions.IsAuthenticated,)
     )
-    @swagger_auto_schema(responses={200: PhotoDownloadLinkSerializer()})
+    @swagger_auto_schema(responses={200: PhotoDownloadLinkSerializer(), 202: PhotoDownloadLinkSerializer()})
     def make_movie_from_best_user_images(self, request):
         top_photos = Photo.get_top_user_photos(request.user)
 
@@ -92,7 +256,7 @@ class PhotoViewSet(viewsets.ModelViewSet):
     @staticmethod
     def _make_request(photos, request):
         """
-        Validate Photos and return Request.
+        Validate Photos, reuse cached movie or enqueue rendering and return Request.
 
         :param photos: Photo's QuerySet
         :type photos: QuerySet[Photo]
@@ -102,16 +266,26 @@ class PhotoViewSet(viewsets.ModelViewSet):
         :rtype: Response
         """
 
-        if photos.count():
-            link = PhotoDownloadLink.make_link()
-            file_path = link.file_path
+        photos = list(photos)
+
+        if photos:
+            cache_key = movie_cache.make_key(photos)
+            link = movie_cache.get(cache_key)
+            response_status = status.HTTP_200_OK
+
+            if link is None:
+                link = PhotoDownloadLink.make_link(cache_key, movie_encoder.extension)
+                response_status = status.HTTP_202_ACCEPTED
 
-            make_movie(photos, file_path)
+                # Reserved link is serialized, the task changes it in the worker
+                render_movie.delay(link.id, [photo.id for photo in photos])
 
             serializer = PhotoDownloadLinkSerializer(link, context={'request': request})
 
             return Response(
-                serializer.data, status=status.HTTP_201_CREATED
+                serializer.data,
+                status=response_status,
+                headers={'Location': serializer.data['status_url']}
             )
         return Response(
             {'server': _('Photos does not exists')}, status=status.HTTP_400_BAD_REQUEST